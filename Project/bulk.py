@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+
+"""bulk.py
+
+Bulk import and export of Conferences and Sessions, run on the task queue.
+
+An import is uploaded once and split into BulkChunk entities of
+CHUNK_ROWS rows each. Every task then imports one chunk and moves the
+job's checkpoint on, queueing the next task in the same transaction, so
+a failed chunk is retried on its own and the job resumes from there. The
+keys a chunk's rows are given are saved on the chunk before anything is
+written, so a retried chunk overwrites its own entities rather than
+creating them twice.
+
+An export walks the kind with a query cursor, writing one chunk per task
+and saving the cursor alongside it, so memory use doesn't grow with the
+size of the data.
+
+Rows hold ConferenceForm or SessionForm fields, either as one JSON object
+per line (ndjson) or as CSV with a header row, where repeated fields are
+separated by '|'. Exported rows can be imported again, though imported
+conferences are given new keys.
+
+"""
+
+import csv
+import json
+import logging
+import StringIO
+
+from protorpc import messages
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import BulkJob
+from models import BulkChunk
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import Session
+from models import SessionForm
+from conference import ConferenceApi
+import cache
+import seats
+import serializers
+
+
+CHUNK_ROWS = 200
+
+# a chunk that has failed this many times fails the whole job
+MAX_TASK_RETRIES = 5
+
+CSV_SEPARATOR = '|'
+
+FORMS = {
+    'Conference': ConferenceForm,
+    'Session': SessionForm,
+}
+MODELS = {
+    'Conference': Conference,
+    'Session': Session,
+}
+FORMATS = ('ndjson', 'csv')
+
+
+#--------------------------------### Rows ###--------------------------------------------------#
+
+def _convert(field, value):
+    """Convert a row value to the type of a form field."""
+    if isinstance(field, messages.IntegerField):
+        return int(value)
+    if isinstance(field, messages.BooleanField):
+        if isinstance(value, basestring):
+            return value.lower() in ('1', 'true', 'yes')
+        return bool(value)
+    return unicode(value)
+
+
+def _rowToForm(form_class, row):
+    """Return a form of form_class filled from a row dict."""
+    form = form_class()
+    for field in form.all_fields():
+        value = row.get(field.name)
+        if value in (None, '', []):
+            continue
+        if field.repeated:
+            if isinstance(value, basestring):
+                value = value.split(CSV_SEPARATOR)
+            value = [_convert(field, v) for v in value]
+        else:
+            value = _convert(field, value)
+        setattr(form, field.name, value)
+    return form
+
+
+def _formToRow(form):
+    """Return a dict of a form's set fields."""
+    row = {}
+    for field in form.all_fields():
+        value = getattr(form, field.name)
+        if value not in (None, []):
+            row[field.name] = list(value) if field.repeated else value
+    return row
+
+
+def _readRows(fmt, data):
+    """Yield each row of a chunk as a dict, or None for a row that can't be read."""
+    if fmt == 'csv':
+        reader = csv.DictReader(StringIO.StringIO(data.encode('utf-8')))
+        for row in reader:
+            yield dict((k, v.decode('utf-8')) for k, v in row.items() if k and v)
+    else:
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else None
+
+
+def _writeRows(fmt, form_class, forms, header):
+    """Return forms written out as text, starting with a CSV header if header."""
+    if fmt != 'csv':
+        return u''.join(json.dumps(_formToRow(form)) + u'\n' for form in forms)
+
+    names = [f.name for f in sorted(form_class.all_fields(), key=lambda f: f.number)]
+    out = StringIO.StringIO()
+    writer = csv.writer(out)
+    if header:
+        writer.writerow(names)
+    for form in forms:
+        row = _formToRow(form)
+        values = []
+        for name in names:
+            value = row.get(name, u'')
+            if isinstance(value, list):
+                value = CSV_SEPARATOR.join(unicode(v) for v in value)
+            values.append(unicode(value).encode('utf-8'))
+        writer.writerow(values)
+    return out.getvalue().decode('utf-8')
+
+
+#--------------------------------### Jobs ###--------------------------------------------------#
+
+def getJob(job_id):
+    """Return the BulkJob with the given id, or None."""
+    return ndb.Key(BulkJob, job_id).get()
+
+
+def _fail(job_key, error):
+    """Mark a job as failed."""
+    job = job_key.get()
+    job.status = 'failed'
+    job.error = error
+    job.put()
+    logging.error("Bulk job %s failed: %s", job_key.id(), error)
+
+
+def jobChunks(job):
+    """Yield the text of each chunk of a job in order, loading one at a time."""
+    for number in range(1, job.chunkCount + 1):
+        chunk = ndb.Key(BulkChunk, number, parent=job.key).get()
+        if chunk:
+            yield chunk.data
+
+
+#--------------------------------### Import ###--------------------------------------------------#
+
+def startImport(kind, fmt, lines, organizerUserId=None):
+    """Split uploaded lines into chunks and queue their import, returning the job.
+
+    Only CHUNK_ROWS lines are held at a time. organizerUserId owns
+    imported conferences that don't name their own organizer.
+    """
+    job_key = ndb.Key(BulkJob, BulkJob.allocate_ids(size=1)[0])
+    header = None
+    rows = []
+    count = 0
+
+    def saveChunk(rows, count):
+        if header:
+            rows = [header] + rows
+        BulkChunk(parent=job_key, id=count, data=u'\n'.join(rows)).put()
+
+    for line in lines:
+        line = line.decode('utf-8').rstrip(u'\r\n')
+        if not line.strip():
+            continue
+        # every CSV chunk gets its own copy of the header
+        if fmt == 'csv' and header is None:
+            header = line
+            continue
+        rows.append(line)
+        if len(rows) == CHUNK_ROWS:
+            count += 1
+            saveChunk(rows, count)
+            rows = []
+    if rows:
+        count += 1
+        saveChunk(rows, count)
+
+    job = BulkJob(key=job_key, mode='import', kind=kind, format=fmt,
+                  organizerUserId=organizerUserId or None, chunkCount=count)
+    if not count:
+        job.status = 'done'
+    job.put()
+    if count:
+        taskqueue.add(url='/tasks/bulk/import', params={'job': job_key.id()})
+    return job
+
+
+def _importRows(job, data):
+    """Return ([(parent key, properties)], skipped) for the rows of a chunk."""
+    api = ConferenceApi()
+    form_class = FORMS[job.kind]
+    rows = []
+    skipped = 0
+    parents = set()
+    for row in _readRows(job.format, data):
+        try:
+            if row is None:
+                raise ValueError("Unreadable row")
+            form = _rowToForm(form_class, row)
+            if job.kind == 'Conference':
+                user_id = form.organizerUserId or job.organizerUserId
+                if not user_id:
+                    raise ValueError("No organizerUserId")
+                parent = ndb.Key(Profile, user_id)
+                rows.append((parent, api._conferenceData(form, user_id)))
+            else:
+                parent = cache.decodeKey(form.websafeConferenceKey)
+                if parent.kind() != 'Conference':
+                    raise ValueError("Not a conference key")
+                rows.append((parent, api._sessionData(form, parent)))
+                parents.add(parent)
+        except Exception as e:
+            logging.warning("Skipping bulk row %s: %s", row, e)
+            skipped += 1
+
+    # sessions need their conference to exist
+    if parents:
+        parents = list(parents)
+        found = set(p for p, conf in zip(parents, ndb.get_multi(parents)) if conf)
+        kept = [(row_parent, props) for row_parent, props in rows if row_parent in found]
+        skipped += len(rows) - len(kept)
+        rows = kept
+    return rows, skipped
+
+
+@ndb.transactional
+def _checkpoint(job_key, number, written, skipped):
+    """Record chunk number as imported, queueing the next chunk if there is one."""
+    job = job_key.get()
+    # a retried task may find the chunk already recorded
+    if job.nextChunk != number - 1:
+        return
+    job.nextChunk = number
+    job.rowCount += written
+    job.skippedCount += skipped
+    if job.nextChunk < job.chunkCount:
+        taskqueue.add(url='/tasks/bulk/import', params={'job': job_key.id()},
+                      transactional=True)
+    else:
+        job.status = 'done'
+    job.put()
+
+
+def importChunk(job_id, retries=0):
+    """Import a job's next chunk."""
+    job = getJob(job_id)
+    if not job or job.status != 'running' or job.nextChunk >= job.chunkCount:
+        return
+    number = job.nextChunk + 1
+    if retries > MAX_TASK_RETRIES:
+        _fail(job.key, "Chunk %s failed %s times" % (number, retries))
+        return
+
+    chunk = ndb.Key(BulkChunk, number, parent=job.key).get()
+    rows, skipped = _importRows(job, chunk.data)
+
+    # give the rows keys once, so a retry writes the same entities again
+    if rows and len(chunk.keys) != len(rows):
+        model = MODELS[job.kind]
+        by_parent = {}
+        for i, (parent, data) in enumerate(rows):
+            by_parent.setdefault(parent, []).append(i)
+        keys = [None] * len(rows)
+        for parent, indexes in by_parent.items():
+            for i, key in zip(indexes, ConferenceApi._allocateKeys(model, parent, len(indexes))):
+                keys[i] = key
+        chunk.keys = keys
+        chunk.put()
+
+    api = ConferenceApi()
+    if job.kind == 'Conference':
+        api._putConferences(chunk.keys, [data for parent, data in rows])
+    else:
+        by_conference = {}
+        for key, (parent, data) in zip(chunk.keys, rows):
+            keys, datas = by_conference.setdefault(parent, ([], []))
+            keys.append(key)
+            datas.append(data)
+        for c_key, (keys, datas) in by_conference.items():
+            api._putSessions(c_key, datas, keys)
+
+    _checkpoint(job.key, number, len(rows), skipped)
+
+
+#--------------------------------### Export ###--------------------------------------------------#
+
+def startExport(kind, fmt):
+    """Queue an export of every entity of kind, returning the job."""
+    job = BulkJob(mode='export', kind=kind, format=fmt)
+    job.put()
+    taskqueue.add(url='/tasks/bulk/export', params={'job': job.key.id()})
+    return job
+
+
+@ndb.transactional
+def _saveExportChunk(job_key, number, data, cursor, written, more):
+    """Save chunk number of an export with the cursor after it, queueing the next."""
+    job = job_key.get()
+    # a retried task may find the chunk already saved
+    if job.chunkCount != number - 1:
+        return
+    BulkChunk(parent=job_key, id=number, data=data).put()
+    job.chunkCount = number
+    job.cursor = cursor
+    job.rowCount += written
+    if more:
+        taskqueue.add(url='/tasks/bulk/export', params={'job': job_key.id()},
+                      transactional=True)
+    else:
+        job.status = 'done'
+    job.put()
+
+
+def exportChunk(job_id, retries=0):
+    """Export a job's next chunk of rows."""
+    job = getJob(job_id)
+    if not job or job.status != 'running':
+        return
+    number = job.chunkCount + 1
+    if retries > MAX_TASK_RETRIES:
+        _fail(job.key, "Chunk %s failed %s times" % (number, retries))
+        return
+
+    start_cursor = Cursor(urlsafe=job.cursor) if job.cursor else None
+    entities, next_cursor, more = MODELS[job.kind].query().fetch_page(
+        CHUNK_ROWS, start_cursor=start_cursor)
+
+    api = ConferenceApi()
+    if job.kind == 'Conference':
+        available = seats.availableMulti(entities)
+        forms = [api._copyConferenceToForm(conf, "", available[conf.key])
+                 for conf in entities]
+    else:
+        forms = serializers.sessionForms(entities)
+    data = _writeRows(job.format, FORMS[job.kind], forms, header=(number == 1))
+
+    more = bool(more and next_cursor)
+    _saveExportChunk(job.key, number, data,
+                     next_cursor.urlsafe() if more else None, len(entities), more)
@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+
+"""cache.py
+
+Read-through caches for frequently read entities and responses.
+
+Profiles, Conferences and Sessions are read through an EntityCache per
+kind: an LRU cache local to the instance, then memcache, then the
+datastore, with get()/getMulti() (and their Async forms) as the one API
+for all three. Entities are cached as encoded protocol buffers. Each has
+a version stamp in memcache that invalidate() bumps, which every code
+path writing a cached entity must call; the bump waits until the
+surrounding transaction (if any) commits. Copies in memcache are stored
+under their version, and local copies are checked against it, so every
+instance sees a write within LOCAL_CHECK_TIME seconds. Websafe keys from
+requests are decoded once and kept in another local LRU cache.
+
+Conference timetables are cached as serialized SessionForms pages under
+a per-conference version stamp. Bumping the version orphans every cached
+page of that conference, which then simply expire. Conference query
+results work the same way, under one generation shared by all queries.
+
+"""
+
+import collections
+import hashlib
+import threading
+import time
+
+from protorpc import protojson
+
+from google.appengine.api import memcache
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import ndb
+
+from models import ConferenceForms
+from models import SessionForms
+
+
+MEMCACHE_VERSION_KEY = "Version:%s"
+MEMCACHE_ENTITY_KEY = "Entity:%s:%s"
+
+# a local copy is served without asking memcache for its version for this
+# many seconds after it was last found current
+LOCAL_CHECK_TIME = 1
+
+LOCAL_KEY_SIZE = 5000
+
+MEMCACHE_TIMETABLE_VERSION_KEY = "TimetableVersion:%s"
+MEMCACHE_TIMETABLE_KEY = "Timetable:%s:%s:%s:%s"
+TIMETABLE_CACHE_TIME = 3600
+
+MEMCACHE_QUERY_GENERATION_KEY = "ConferenceQueryGeneration"
+MEMCACHE_QUERY_KEY = "ConferenceQuery:%s:%s"
+QUERY_CACHE_TIME = 60
+
+CACHE_NAMES = ('profile', 'conference', 'session', 'timetable', 'query')
+# hits includes localHits, entities served without a memcache get
+STAT_FIELDS = ('hits', 'localHits', 'misses', 'evictions')
+
+# hit/miss counts are kept per instance and added to the memcache totals
+# every STATS_FLUSH_EVERY lookups, rather than costing an RPC per lookup
+MEMCACHE_STATS_KEY = "CacheStats:%s:%s"
+STATS_FLUSH_EVERY = 50
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+class LRUCache(object):
+    """LRUCache -- Bounded, thread-safe cache local to this instance.
+
+    Entries are evicted least recently used first once maxsize is
+    reached, and expire ttl seconds after being set if ttl is given.
+    onEvict, if given, is called after each eviction.
+    """
+
+    def __init__(self, maxsize, ttl=None, onEvict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.onEvict = onEvict
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value cached for key, or default."""
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires < time.time():
+                return default
+            # re-insert, so the key becomes the most recently used
+            self._items[key] = item
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Cache value for key, evicting the least recently used if full."""
+        ttl = ttl or self.ttl
+        expires = time.time() + ttl if ttl else None
+        evicted = 0
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, expires)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                evicted += 1
+        if self.onEvict:
+            for i in range(evicted):
+                self.onEvict()
+
+    def delete(self, key):
+        """Drop key from the cache."""
+        with self._lock:
+            self._items.pop(key, None)
+
+    def __len__(self):
+        return len(self._items)
+
+
+# websafe key -> ndb.Key; a key never changes, so these don't expire
+_local_keys = LRUCache(LOCAL_KEY_SIZE)
+
+
+def decodeKey(safe_key):
+    """Return the ndb.Key for a websafe key, decoding each one once per instance.
+
+    Raises whatever ndb.Key does for a string that isn't a key; those
+    aren't cached.
+    """
+    key = _local_keys.get(safe_key)
+    if key is None:
+        key = ndb.Key(urlsafe=safe_key)
+        _local_keys.set(safe_key, key)
+    return key
+
+
+def _serialize(entity):
+    """Encode an entity for memcache."""
+    return ndb.model_to_protobuf(entity).Encode()
+
+
+def _deserialize(data):
+    """Decode an entity stored by _serialize."""
+    return ndb.model_from_protobuf(entity_pb.EntityProto(data))
+
+
+def _count(name, hit, n=1):
+    """Count n hits or misses for the named cache; hit may also name the field."""
+    if hit is True:
+        field = 'hits'
+    elif hit is False:
+        field = 'misses'
+    else:
+        field = hit
+    with _stats_lock:
+        counts = _stats.setdefault(name, {})
+        counts[field] = counts.get(field, 0) + n
+        if counts.get('hits', 0) + counts.get('misses', 0) < STATS_FLUSH_EVERY:
+            return
+        pending = dict((MEMCACHE_STATS_KEY % (name, f), n)
+                       for f, n in counts.items() if n)
+        _stats[name] = {}
+    memcache.offset_multi(pending, initial_value=0)
+
+
+def stats():
+    """Return {cache name: {field: n}} across all instances, for each of STAT_FIELDS."""
+    with _stats_lock:
+        local = dict((name, dict(counts)) for name, counts in _stats.items())
+    names = set(local) | set(CACHE_NAMES)
+    stored = memcache.get_multi([MEMCACHE_STATS_KEY % (name, f)
+                                 for name in names for f in STAT_FIELDS])
+    result = {}
+    for name in names:
+        result[name] = dict(
+            (f, stored.get(MEMCACHE_STATS_KEY % (name, f), 0) +
+                local.get(name, {}).get(f, 0))
+            for f in STAT_FIELDS)
+    return result
+
+
+#--------------------------------### Entities ###--------------------------------------------------#
+
+def _newVersion():
+    """Return a version stamp to start a missing or evicted one from.
+
+    Stamps start from the clock in microseconds and go up by one per
+    invalidation. A stamp can't catch up with a later restart unless it
+    is bumped more than a million times a second, so a restarted stamp
+    never comes back around to one that still has copies cached.
+    """
+    return int(time.time() * 1000000)
+
+
+@ndb.tasklet
+def _versionsAsync(keys):
+    """Return a future for {key: current version stamp} of keys, starting any that are missing."""
+    ctx = ndb.get_context()
+    version_keys = [MEMCACHE_VERSION_KEY % key.urlsafe() for key in keys]
+    versions = yield [ctx.memcache_get(vk) for vk in version_keys]
+    missing = [i for i, version in enumerate(versions) if version is None]
+    if missing:
+        start = _newVersion()
+        added = yield [ctx.memcache_add(version_keys[i], start) for i in missing]
+        for i in missing:
+            versions[i] = start
+        lost = [i for i, ok in zip(missing, added) if not ok]
+        if lost:
+            # another request started them first
+            again = yield [ctx.memcache_get(version_keys[i]) for i in lost]
+            for i, version in zip(lost, again):
+                if version is not None:
+                    versions[i] = version
+    raise ndb.Return(dict(zip(keys, versions)))
+
+
+class EntityCache(object):
+    """EntityCache -- One kind's entities, cached locally and in memcache.
+
+    Local entries are (version, encoded entity, time last found current).
+    """
+
+    def __init__(self, name, maxsize, ttl, memcache_time):
+        self.name = name
+        self.memcache_time = memcache_time
+        self.local = LRUCache(maxsize, ttl,
+                              onEvict=lambda: _count(name, 'evictions'))
+
+    @ndb.tasklet
+    def getMultiAsync(self, keys):
+        """Return a future for the entities of keys, with None where there is none."""
+        now = time.time()
+        found = {}
+        stale = {}
+        for key in set(keys):
+            item = self.local.get(key)
+            if item is None:
+                continue
+            if now - item[2] < LOCAL_CHECK_TIME:
+                found[key] = item[1]
+            else:
+                stale[key] = item
+        local_hits = len(found)
+
+        missing = [key for key in set(keys) if key not in found]
+        if missing:
+            ctx = ndb.get_context()
+            versions = yield _versionsAsync(missing)
+            # local copies that are still current
+            for key, (version, data, checked) in stale.items():
+                if versions[key] == version:
+                    found[key] = data
+                    self.local.set(key, (version, data, now))
+            local_hits = len(found)
+
+            missing = [key for key in missing if key not in found]
+            cached = []
+            if missing:
+                cached = yield [ctx.memcache_get(MEMCACHE_ENTITY_KEY % (key.urlsafe(), versions[key]))
+                                for key in missing]
+            for key, data in zip(missing, cached):
+                if data is not None:
+                    found[key] = data
+                    self.local.set(key, (versions[key], data, now))
+
+            missing = [key for key in missing if key not in found]
+            if missing:
+                entities = yield ndb.get_multi_async(missing)
+                adds = []
+                for key, entity in zip(missing, entities):
+                    if entity is None:
+                        continue
+                    data = found[key] = _serialize(entity)
+                    self.local.set(key, (versions[key], data, now))
+                    adds.append(ctx.memcache_add(MEMCACHE_ENTITY_KEY % (key.urlsafe(), versions[key]),
+                                                 data, time=self.memcache_time))
+                if adds:
+                    yield adds
+
+        if local_hits:
+            _count(self.name, 'localHits', local_hits)
+        hits = len(set(keys)) - len(missing)
+        if hits:
+            _count(self.name, True, hits)
+        if missing:
+            _count(self.name, False, len(missing))
+        raise ndb.Return([_deserialize(found[key]) if key in found else None
+                          for key in keys])
+
+    def invalidate(self, keys):
+        """Drop keys' local copies, and bump their versions once the current transaction commits."""
+        for key in keys:
+            self.local.delete(key)
+        offsets = dict((MEMCACHE_VERSION_KEY % key.urlsafe(), 1) for key in keys)
+        ndb.get_context().call_on_commit(
+            lambda: memcache.offset_multi(offsets, initial_value=_newVersion()))
+
+
+PROFILES = EntityCache('profile', maxsize=1000, ttl=300, memcache_time=600)
+CONFERENCES = EntityCache('conference', maxsize=500, ttl=300, memcache_time=600)
+SESSIONS = EntityCache('session', maxsize=2000, ttl=300, memcache_time=3600)
+
+# kind -> its EntityCache; other kinds go straight to the datastore
+_entity_caches = {
+    'Profile': PROFILES,
+    'Conference': CONFERENCES,
+    'Session': SESSIONS,
+}
+
+
+@ndb.tasklet
+def getMultiAsync(keys):
+    """Return a future for the entities of keys, of any kinds, with None where there is none."""
+    by_cache = {}
+    for key in keys:
+        by_cache.setdefault(_entity_caches.get(key.kind()), []).append(key)
+    futures = []
+    for entity_cache, cache_keys in by_cache.items():
+        if entity_cache:
+            futures.append(entity_cache.getMultiAsync(cache_keys))
+        else:
+            futures.append(ndb.get_multi_async(cache_keys))
+    results = yield futures
+    entities = {}
+    for (entity_cache, cache_keys), found in zip(by_cache.items(), results):
+        entities.update(zip(cache_keys, found))
+    raise ndb.Return([entities[key] for key in keys])
+
+
+def getMulti(keys):
+    """Return the entities of keys, with None where there is none."""
+    return getMultiAsync(keys).get_result()
+
+
+@ndb.tasklet
+def getAsync(key):
+    """Return a future for the entity of key, or None."""
+    entities = yield getMultiAsync([key])
+    raise ndb.Return(entities[0])
+
+
+def get(key):
+    """Return the entity of key, or None."""
+    return getAsync(key).get_result()
+
+
+def invalidate(keys):
+    """Make every instance reread keys' entities; call whenever they are put or deleted."""
+    by_cache = {}
+    for key in keys:
+        entity_cache = _entity_caches.get(key.kind())
+        if entity_cache:
+            by_cache.setdefault(entity_cache, []).append(key)
+    for entity_cache, cache_keys in by_cache.items():
+        entity_cache.invalidate(cache_keys)
+
+
+def getProfileAsync(p_key):
+    """Return a future for the Profile for p_key, or None."""
+    return getAsync(p_key)
+
+
+def getProfile(p_key):
+    """Return the Profile for p_key, or None."""
+    return get(p_key)
+
+
+def invalidateProfile(p_key):
+    """Drop a Profile from the cache; call whenever a Profile is put."""
+    invalidate([p_key])
+
+
+def getConferenceAsync(wsck):
+    """Return a future for the Conference of a websafe key, or None if there isn't one."""
+    try:
+        c_key = decodeKey(wsck)
+    except Exception:
+        c_key = None
+    if not c_key or c_key.kind() != 'Conference':
+        future = ndb.Future()
+        future.set_result(None)
+        return future
+    return getAsync(c_key)
+
+
+def getConference(wsck):
+    """Return the Conference for a websafe key, or None if there isn't one."""
+    return getConferenceAsync(wsck).get_result()
+
+
+def invalidateConference(c_key):
+    """Drop a Conference from the caches; call whenever a Conference is put."""
+    invalidate([c_key])
+
+
+#--------------------------------### Responses ###--------------------------------------------------#
+
+def _version(version_key):
+    """Return the current version stored under version_key."""
+    version = memcache.get(version_key)
+    if version is None:
+        version = _newVersion()
+        if not memcache.add(version_key, version):
+            version = memcache.get(version_key) or version
+    return version
+
+
+def getTimetable(wsck, pageSize, cursor, build):
+    """Return a page of a conference's SessionForms, calling build() on a miss."""
+    version = _version(MEMCACHE_TIMETABLE_VERSION_KEY % wsck)
+    page = hashlib.sha1(cursor or '').hexdigest()
+    page_key = MEMCACHE_TIMETABLE_KEY % (wsck, version, pageSize, page)
+    data = memcache.get(page_key)
+    if data is not None:
+        _count('timetable', True)
+        return protojson.decode_message(SessionForms, data)
+
+    _count('timetable', False)
+    forms = build()
+    memcache.set(page_key, protojson.encode_message(forms),
+                 time=TIMETABLE_CACHE_TIME)
+    return forms
+
+
+def invalidateTimetable(wsck):
+    """Move a conference's timetable to a new version; call when its sessions change."""
+    memcache.incr(MEMCACHE_TIMETABLE_VERSION_KEY % wsck,
+                  initial_value=_newVersion())
+
+
+def getConferenceQuery(canonical, build):
+    """Return ConferenceForms for a canonical query, calling build() on a miss.
+
+    canonical must be the same for every request that returns the same
+    results, whatever order or spelling its filters came in.
+    """
+    generation = _version(MEMCACHE_QUERY_GENERATION_KEY)
+    digest = hashlib.sha1(repr(canonical)).hexdigest()
+    query_key = MEMCACHE_QUERY_KEY % (generation, digest)
+    data = memcache.get(query_key)
+    if data is not None:
+        _count('query', True)
+        return protojson.decode_message(ConferenceForms, data)
+
+    _count('query', False)
+    forms = build()
+    memcache.set(query_key, protojson.encode_message(forms),
+                 time=QUERY_CACHE_TIME)
+    return forms
+
+
+def invalidateConferenceQueries():
+    """Start a new query generation; call when conferences or their seats change."""
+    memcache.incr(MEMCACHE_QUERY_GENERATION_KEY,
+                  initial_value=_newVersion())
@@ -26,6 +26,8 @@ from protorpc import remote
 from google.appengine.ext import ndb
 from google.appengine.api import taskqueue
 from google.appengine.api import memcache
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
 
 ### Custom Models Imports ###
 # -Profile
@@ -33,6 +35,10 @@ from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
 from models import TeeShirtSize
+from models import Registration
+from models import RegistrationRequest
+from models import RegistrationStatus
+from models import RegistrationStatusForm
 # -Conference
 from models import Conference
 from models import ConferenceForm
@@ -46,19 +52,39 @@ from models import ConflictException
 
 # -Session
 from models import Session
+from models import Speaker
+from models import SpeakerConference
+from models import FeaturedSpeaker
+from models import SpeakerSession
 from models import SessionForm
 from models import SessionForms
+from models import SessionBatchForm
 from models import QuerySessionByKey
 from models import QuerySessionByType
 from models import QuerySessionBySpeaker
 from models import QuerySessionByDuration
 from models import QuerySessionByStartTime
+from models import SessionQueryForms
+from models import SessionSearchForms
 from models import SessionWebsafe
 from models import WishlistResponse
+from models import WishlistConferenceForms
+from models import WishlistConferenceForm
+from models import WishlistConflictForms
+from models import WishlistConflictForm
+from models import WishlistSyncForm
+from models import WishlistSyncResponse
 from models import StringMessage
 
 ### Settings and Utilities ###
 from utils import getUserId
+import seats
+import cache
+import search
+import serializers
+import rpcstats
+import registrations
+import schedule
 
 from settings import WEB_CLIENT_ID
 
@@ -106,7 +132,34 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+REGISTRATION_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    token=messages.StringField(2),
+)
+
+# longest idempotency token a queued registration may use
+MAX_TOKEN_LENGTH = 100
+
 MEMCACHE_FEATURED_KEY = "FeaturedKEY"
+# each conference's featured speaker is also kept under its own key
+MEMCACHE_CONF_FEATURED_KEY = "FeaturedKEY:%s"
+
+# most sessions counted in one Speaker transaction, keeping each commit
+# well under the datastore's limit on entities written
+SPEAKER_INDEX_CHUNK = 200
+
+# number of profiles moved over per /tasks/migrateRegistrations batch, and
+# of sessions indexed per /tasks/indexSpeakers batch
+MIGRATION_BATCH_SIZE = 100
+
+# most sessions createSessions will take in one call
+MAX_SESSION_BATCH = 500
+
+# page size used when a query request doesn't ask for one, and the most
+# results a single page may return
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
 
   ########################
 #### Endpoint Functions ###########################################################
@@ -125,14 +178,7 @@ class ConferenceApi(remote.Service):
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
         # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
+        pf = serializers.PROFILE.toForm(prof)
         pf.check_initialized()
         return pf
 
@@ -143,10 +189,10 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
 
-        # get Profile from datastore
+        # get Profile from the cache, or datastore
         user_id = getUserId(user)
         p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = cache.getProfile(p_key)
         # create new Profile if not there
         if not profile:
             profile = Profile(
@@ -156,6 +202,23 @@ class ConferenceApi(remote.Service):
                 teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
             )
             profile.put()
+            cache.invalidateProfile(p_key)
+        # move a wishlist of websafe strings over to Keys, once
+        elif profile.legacyWishlist:
+            for safekey in profile.legacyWishlist:
+                # the old wishlist took any key it was given; drop the
+                # ones that aren't sessions rather than fail the put
+                try:
+                    s_key = cache.decodeKey(safekey)
+                except Exception:
+                    continue
+                if s_key.kind() != 'Session':
+                    continue
+                if s_key not in profile.sessionWishlist:
+                    profile.sessionWishlist.append(s_key)
+            profile.legacyWishlist = []
+            profile.put()
+            cache.invalidateProfile(p_key)
 
         return profile      # return Profile
 
@@ -173,6 +236,7 @@ class ConferenceApi(remote.Service):
                     if val:
                         setattr(prof, field, str(val))
             prof.put()
+            cache.invalidateProfile(prof.key)
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -180,6 +244,7 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
+    @rpcstats.instrumented
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
@@ -187,6 +252,7 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
             path='profile', http_method='POST', name='saveProfile')
+    @rpcstats.instrumented
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
@@ -194,32 +260,21 @@ class ConferenceApi(remote.Service):
 
 #--------------------------------### Conferences ###--------------------------------------------------#
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, displayName, seatsAvailable=None):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+        # seats are counted across the conference's seat shards
+        if seatsAvailable is None:
+            seatsAvailable = seats.available(conf)
+        cf = serializers.CONFERENCE.toForm(conf, websafeKey=conf.key.urlsafe(),
+                                           seatsAvailable=seatsAvailable)
         if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
+            cf.organizerDisplayName = displayName
         cf.check_initialized()
         return cf
 
 
-    def _createConferenceObject(self, request):
-        """Create or update Conference object, returning ConferenceForm/request."""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
+    def _conferenceData(self, request, user_id):
+        """Return Conference properties from a ConferenceForm, filling defaults into both."""
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
 
@@ -249,23 +304,58 @@ class ConferenceApi(remote.Service):
             data["seatsAvailable"] = data["maxAttendees"]
             setattr(request, "seatsAvailable", data["maxAttendees"])
 
-        # make Profile Key from user ID
-        p_key = ndb.Key(Profile, user_id)
-        # allocate new Conference ID with Profile key as parent
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        # make Conference key from ID
-        c_key = ndb.Key(Conference, c_id, parent=p_key)
-        data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
+        return data
+
+
+    @staticmethod
+    def _allocateKeys(model, parent, size):
+        """Return size new keys of model under parent, from one allocate_ids call."""
+        first, last = model.allocate_ids(size=size, parent=parent)
+        return [ndb.Key(model, new_id, parent=parent) for new_id in range(first, last + 1)]
+
+
+    def _putConferences(self, c_keys, conferences_data):
+        """Store new Conferences, with their seat shards, from their keys and properties."""
+        entities = []
+        for c_key, data in zip(c_keys, conferences_data):
+            data = dict(data)
+            # spread the seats across seat shards, so registration doesn't
+            # contend on the Conference entity
+            shards = []
+            if data["seatsAvailable"] > 0:
+                shards = seats.makeShards(c_key, data["seatsAvailable"])
+                data['seatShards'] = len(shards)
+            entities.append(Conference(key=c_key, **data))
+            entities.extend(shards)
+
+        ndb.put_multi(entities)
+        for c_key in c_keys:
+            cache.invalidateConference(c_key)
+        cache.invalidateConferenceQueries()
 
-        # create Conference & return (modified) ConferenceForm
-        Conference(**data).put()
 
+    def _createConferenceObject(self, request):
+        """Create or update Conference object, returning ConferenceForm/request."""
+        # preload necessary data items
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+        data = self._conferenceData(request, user_id)
+
+        # allocate new Conference ID with Profile key as parent
+        p_key = ndb.Key(Profile, user_id)
+        c_keys = self._allocateKeys(Conference, p_key, 1)
+
+        # create Conference & return (modified) ConferenceForm
+        self._putConferences(c_keys, [data])
         return request
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
+    @rpcstats.instrumented
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -275,19 +365,60 @@ class ConferenceApi(remote.Service):
                 path='queryConferences',
                 http_method='POST',
                 name='queryConferences')
+    @rpcstats.instrumented
     def queryConferences(self, request):
-        """Query for conferences."""
-        #conferences = Conference.query()
-        conferences = self._getQuery(request)
-         # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") \
-            for conf in conferences]
+        """Query for conferences, one page at a time."""
+        inequality_filter, filters = self._formatFilters(request.filters)
+
+        def build():
+            conferences = self._getQuery(inequality_filter, filters)
+            conferences, nextCursor, more = self._fetchPage(
+                conferences, request.pageSize, request.cursor)
+            available = seats.availableMulti(conferences)
+             # return individual ConferenceForm object per Conference
+            return ConferenceForms(
+                items=[self._copyConferenceToForm(conf, "", available[conf.key]) \
+                for conf in conferences],
+                nextCursor=nextCursor,
+                more=more
+            )
+
+        # the same filters in any order or spelling share a cache entry
+        canonical = (
+            sorted(set((f["field"], f["operator"], f["value"]) for f in filters)),
+            self._pageSize(request.pageSize),
+            request.cursor or '',
         )
+        return cache.getConferenceQuery(canonical, build)
+
+    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+            path='conference/{websafeConferenceKey}',
+            http_method='GET', name='getConference')
+    @rpcstats.instrumented
+    def getConference(self, request):
+        """Return requested conference (by websafeConferenceKey)."""
+        wsck = request.websafeConferenceKey
+        try:
+            c_key = cache.decodeKey(wsck)
+        except Exception:
+            c_key = None
+        if not c_key or c_key.kind() != 'Conference':
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        # the organizer's profile key is in the conference key, so fetch both at once
+        conf_future = cache.getConferenceAsync(wsck)
+        prof_future = cache.getProfileAsync(c_key.parent())
+        conf = conf_future.get_result()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        prof = prof_future.get_result()
+        return self._copyConferenceToForm(conf, getattr(prof, 'displayName', ''))
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
+    @rpcstats.instrumented
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
@@ -297,23 +428,27 @@ class ConferenceApi(remote.Service):
     
         # make profile key
         p_key = ndb.Key(Profile, getUserId(user))
-        # create ancestor query for this user
-        conferences = Conference.query(ancestor=p_key)
-        # get the user profile and display name
-        prof = p_key.get()
+        # create ancestor query for this user, and get the user profile
+        # while it runs
+        conferences_future = Conference.query(ancestor=p_key).fetch_async()
+        prof_future = cache.getProfileAsync(p_key)
+        conferences = conferences_future.get_result()
+        # get the display name
+        prof = prof_future.get_result()
         displayName = getattr(prof, 'displayName')
+        available = seats.availableMulti(conferences)
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, displayName) for conf in conferences]
+            items=[self._copyConferenceToForm(conf, displayName, available[conf.key])
+                   for conf in conferences]
         )
 
 
 #--------------------------------### Queries ###--------------------------------------------------#
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
+    def _getQuery(self, inequality_filter, filters):
+        """Return formatted query from the formatted filters."""
         q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
 
         # If exists, sort on inequality filter first
         if not inequality_filter:
@@ -321,10 +456,11 @@ class ConferenceApi(remote.Service):
         else:
             q = q.order(ndb.GenericProperty(inequality_filter))
             q = q.order(Conference.name)
+        # a != filter runs as several queries merged together, which can
+        # only hand out cursors when ordered by key as well
+        q = q.order(Conference.key)
 
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
             formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
         return q
@@ -340,10 +476,19 @@ class ConferenceApi(remote.Service):
 
             try:
                 filtr["field"] = FIELDS[filtr["field"]]
-                filtr["operator"] = OPERATORS[filtr["operator"]]
+                # accept the operator symbols as well as their names
+                if filtr["operator"] not in OPERATORS.values():
+                    filtr["operator"] = OPERATORS[filtr["operator"]]
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter on %s needs a number." % filtr["field"])
+
             # Every operation except "=" is an inequality
             if filtr["operator"] != "=":
                 # check if inequality operation has been used in previous filters
@@ -357,86 +502,211 @@ class ConferenceApi(remote.Service):
             formatted_filters.append(filtr)
         return (inequality_field, formatted_filters)
 
+
+    def _pageSize(self, pageSize):
+        """Return the page size to use for a requested page size."""
+        if not pageSize or pageSize <= 0:
+            return DEFAULT_PAGE_SIZE
+        return min(pageSize, MAX_PAGE_SIZE)
+
+
+    def _decodeCursor(self, cursor):
+        """Turn a cursor handed out by _fetchPage back into a Cursor."""
+        if not cursor:
+            return None
+        try:
+            return Cursor(urlsafe=cursor)
+        except datastore_errors.BadValueError:
+            raise endpoints.BadRequestException("Invalid cursor: %s" % cursor)
+
+
+    def _fetchPage(self, query, pageSize, cursor):
+        """Fetch a single page of query, returning (results, nextCursor, more)."""
+        pageSize = self._pageSize(pageSize)
+        start_cursor = self._decodeCursor(cursor)
+        results, next_cursor, more = query.fetch_page(
+            pageSize, start_cursor=start_cursor)
+        if more and next_cursor:
+            return (results, next_cursor.urlsafe(), True)
+        return (results, None, False)
+
 #--------------------------------### Registration ###--------------------------------------------------#
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
         retval = None
+        # start fetching the conference while the profile is loaded
+        wsck = request.websafeConferenceKey
+        conf_future = cache.getConferenceAsync(wsck)
         prof = self._getProfileFromUser() # get user Profile
+        p_key = prof.key
+        r_key = ndb.Key(Registration, wsck, parent=p_key)
+        registered_future = r_key.get_async() if reg else None
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        conf = conf_future.get_result()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
+        waitlist_future = registrations.hasWaitlistAsync(conf.key.urlsafe()) if reg else None
 
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if wsck in prof.conferenceKeysToAttend or registered_future.get_result():
                 raise ConflictException(
                     "You have already registered for this conference")
+            # seats that come free go to the waitlist first
+            if waitlist_future.get_result():
+                raise ConflictException(
+                    "There are no seats available. Use requestRegistration to join the waitlist.")
+
+            def takeSeat():
+                # runs in the same transaction as taking the seat
+                if r_key.get():
+                    raise ConflictException(
+                        "You have already registered for this conference")
+                Registration(key=r_key, conferenceKey=conf.key).put()
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
+            # register user, take away one seat from a seat shard
+            if not seats.claim(conf, takeSeat):
                 raise ConflictException(
                     "There are no seats available.")
-
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
             retval = True
+            cache.invalidateConferenceQueries()
 
         # unregister
         else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
-
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
+            def giveSeat():
+                # runs in the same transaction as giving the seat back
+                freed = False
+                if r_key.get():
+                    r_key.delete()
+                    freed = True
+                else:
+                    # not migrated yet, so still on the profile
+                    prof = p_key.get()
+                    if wsck in prof.conferenceKeysToAttend:
+                        prof.conferenceKeysToAttend.remove(wsck)
+                        prof.put()
+                        cache.invalidateProfile(p_key)
+                        freed = True
+                # the seat goes to whoever has waited longest
+                if freed:
+                    registrations.queuePromotion(conf.key.urlsafe())
+                return freed
+
+            # unregister user, add back one seat
+            retval = seats.release(conf, giveSeat)
+            if retval:
+                cache.invalidateConferenceQueries()
             else:
-                retval = False
+                # not registered, but maybe waiting for a seat
+                retval = registrations.leaveWaitlist(conf.key.urlsafe(), p_key)
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
         return BooleanMessage(data=retval)
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
+    @rpcstats.instrumented
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
 
 
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}',
+            http_method='DELETE', name='unregisterFromConference')
+    @rpcstats.instrumented
+    def unregisterFromConference(self, request):
+        """Unregister user from selected conference, or take them off its waitlist."""
+        return self._conferenceRegistration(request, reg=False)
+
+
+    def _registrationStatusForm(self, wsck, token, status, p_key):
+        """Return a RegistrationStatusForm, with the waitlist position if waitlisted."""
+        form = RegistrationStatusForm(websafeConferenceKey=wsck, token=token,
+                                      status=getattr(RegistrationStatus, status))
+        if status == 'WAITLISTED':
+            form.waitlistPosition = registrations.waitlistPosition(wsck, p_key)
+        return form
+
+
+    @endpoints.method(REGISTRATION_REQUEST, RegistrationStatusForm,
+            path='conference/{websafeConferenceKey}/registration',
+            http_method='POST', name='requestRegistration')
+    @rpcstats.instrumented
+    def requestRegistration(self, request):
+        """websafeConferenceKey, token -- Queue a registration, joining the waitlist if the conference is full."""
+        token = request.token
+        if not token or len(token) > MAX_TOKEN_LENGTH:
+            raise endpoints.BadRequestException(
+                "A 'token' of at most %s characters is required" % MAX_TOKEN_LENGTH)
+        wsck = request.websafeConferenceKey
+        conf_future = cache.getConferenceAsync(wsck)
+        prof = self._getProfileFromUser() # get user Profile
+        conf = conf_future.get_result()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        wsck = conf.key.urlsafe()
+        req_key = ndb.Key(RegistrationRequest, token, parent=prof.key)
+        registered, req = ndb.get_multi([ndb.Key(Registration, wsck, parent=prof.key), req_key])
+        if registered or wsck in prof.conferenceKeysToAttend:
+            # a request that got the registration can be asked again
+            if not req or req.conferenceKey != conf.key:
+                raise ConflictException(
+                    "You have already registered for this conference")
+        else:
+            req = registrations.request(prof.key, conf.key, token)
+        if req.conferenceKey != conf.key:
+            raise endpoints.BadRequestException(
+                "That token was already used for another conference")
+        return self._registrationStatusForm(conf.key.urlsafe(), token, req.status, prof.key)
+
+
+    @endpoints.method(REGISTRATION_REQUEST, RegistrationStatusForm,
+            path='conference/{websafeConferenceKey}/registration',
+            http_method='GET', name='getRegistrationStatus')
+    @rpcstats.instrumented
+    def getRegistrationStatus(self, request):
+        """websafeConferenceKey, token -- Return the state of a queued registration."""
+        prof = self._getProfileFromUser() # get user Profile
+        req = None
+        if request.token:
+            req = ndb.Key(RegistrationRequest, request.token, parent=prof.key).get()
+        try:
+            c_key = cache.decodeKey(request.websafeConferenceKey)
+        except Exception:
+            c_key = None
+        if not req or not c_key or req.conferenceKey != c_key:
+            raise endpoints.NotFoundException(
+                'No registration request found with token: %s' % request.token)
+        return self._registrationStatusForm(c_key.urlsafe(), request.token, req.status, prof.key)
+
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
+    @rpcstats.instrumented
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
-        # TODO:
-        # step 1: get user profile
         profile = self._getProfileFromUser() # get user Profile
-        # step 2: get conferenceKeysToAttend from profile.
-        safekeys = profile.conferenceKeysToAttend
-        # to make a ndb key from websafe key you can use:
-        #keys = ()
-        #for safekey in safekeys:
-        #    keys.append(ndb.Key(urlsafe=safekey))
-        keys = (ndb.Key(urlsafe=safekey) for safekey in safekeys)
-        # step 3: fetch conferences from datastore. 
-        # Use get_multi(array_of_keys) to fetch all keys at once.
-        # Do not fetch them one by one!
-        conferences = ndb.get_multi(keys)
+        # registrations are children of the profile, named by websafe key
+        r_keys = Registration.query(ancestor=profile.key).fetch(keys_only=True)
+        safekeys = [r_key.id() for r_key in r_keys]
+        # include any registrations not yet migrated off the profile
+        safekeys.extend(safekey for safekey in profile.conferenceKeysToAttend
+                        if safekey not in safekeys)
+        keys = [cache.decodeKey(safekey) for safekey in safekeys]
+        # fetch all conferences at once
+        conferences = cache.getMulti(keys)
+        available = seats.availableMulti(conferences)
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, "")\
+        return ConferenceForms(items=[self._copyConferenceToForm(conf, "", available[conf.key])\
          for conf in conferences]
         )
     
@@ -444,120 +714,229 @@ class ConferenceApi(remote.Service):
 #### Additional Functionality ########################################
   ##############################
     
-    #Backend process for turning query results into result objects
-    def _formatSession(self, session):
-        """Copy relevant fields from Session to SessionForm."""
-        result = SessionForm()
-        for field in result.all_fields():
-            if hasattr(session, field.name):
-                # convert Date to date string; just copy others
-                if field.name == 'startTime' or field.name == 'date':
-                    setattr(result, field.name, str(getattr(session, field.name)))
-                else:
-                    setattr(result, field.name, getattr(session, field.name))
-                    #setattr(result, field.name, field.name)
-            if field.name == "websafeConferenceKey":
-                setattr(result, field.name, session.key.parent().urlsafe())
-            if field.name == "websafeKey":
-                setattr(result, field.name, session.key.urlsafe())
-        #if displayName:
-        #setattr(cf, 'organizerDisplayName', displayName)
-        if not result.websafeKey:
-            raise endpoints.BadRequestException("Oh noes")
-        result.check_initialized()
-        return result
+    #Backend process for paging through a session query
+    def _sessionPage(self, query, request):
+        """Return one page of a Session query as SessionForms."""
+        sessions, nextCursor, more = self._fetchPage(
+            query, request.pageSize, request.cursor)
+        return SessionForms(
+            items=serializers.sessionForms(sessions),
+            nextCursor=nextCursor,
+            more=more
+        )
 
     
-    #Backend process to create a session
-    def _createSession(self, request):
-        """Add a Session, returning Session/request."""
+    #Backend process to add sessions to a speaker's index
+    @staticmethod
+    @ndb.transactional_tasklet
+    def _indexSpeakerAsync(name, s_keys):
+        """Count session keys in a Speaker's index, creating the Speaker if needed.
+
+        Returns a future for the Speaker. Each counted session gets a
+        SpeakerSession row under the Speaker, so sessions counted before
+        are skipped and indexing the same sessions twice is harmless.
+        """
+        sp_key = ndb.Key(Speaker, name)
+        row_keys = [ndb.Key(SpeakerSession, s_key.urlsafe(), parent=sp_key) for s_key in s_keys]
+        found = yield [sp_key.get_async()] + ndb.get_multi_async(row_keys)
+        speaker, rows = found[0], found[1:]
+        if not speaker:
+            speaker = Speaker(id=name, name=name)
+        # sessions counted before the rows existed are listed on the Speaker
+        legacy = set(speaker.sessionKeys)
+        new_keys = [s_key for s_key, row in zip(s_keys, rows)
+                    if not row and s_key not in legacy]
+        if not new_keys:
+            raise ndb.Return(speaker)
+
+        counts = dict((c.conferenceKey, c) for c in speaker.conferences)
+        for s_key in new_keys:
+            c_key = s_key.parent()
+            if c_key not in counts:
+                counts[c_key] = SpeakerConference(conferenceKey=c_key, sessionCount=0)
+                speaker.conferences.append(counts[c_key])
+            counts[c_key].sessionCount += 1
+        yield ndb.put_multi_async([speaker] + [
+            SpeakerSession(id=s_key.urlsafe(), parent=sp_key) for s_key in new_keys])
+        raise ndb.Return(speaker)
+
+    #Backend process to index one speaker's sessions a chunk at a time
+    @staticmethod
+    @ndb.tasklet
+    def _indexSpeakerChunksAsync(name, s_keys):
+        """Count session keys in a Speaker's index, SPEAKER_INDEX_CHUNK per transaction."""
+        unique = []
+        for s_key in s_keys:
+            if s_key not in unique:
+                unique.append(s_key)
+        speaker = None
+        for i in range(0, len(unique), SPEAKER_INDEX_CHUNK):
+            speaker = yield ConferenceApi._indexSpeakerAsync(name, unique[i:i + SPEAKER_INDEX_CHUNK])
+        raise ndb.Return(speaker)
+
+    #Backend process to index many speakers' sessions
+    @staticmethod
+    def _indexSpeakerSessions(by_speaker):
+        """Count each speaker's session keys in their index, speakers concurrently."""
+        futures = [ConferenceApi._indexSpeakerChunksAsync(speaker, s_keys)
+                   for speaker, s_keys in by_speaker.items()]
+        return [future.get_result() for future in futures]
+
+    #Backend process to check ownership of a conference
+    def _conferenceOwnerKey(self, safe_key):
+        """Return a conference's key, checking the current user owns it."""
         # preload necessary data items
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
-        
-        if not request.name:
-            raise endpoints.BadRequestException("Conference 'name' field required")
-        
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-        
-        conference_id = ndb.Key(urlsafe=data['websafeConferenceKey'])
+
+        c_key = cache.decodeKey(safe_key)
         #check if the user id is the same as the conference's parent.
-        if user_id != conference_id.parent().string_id():
+        if user_id != c_key.parent().string_id():
             raise endpoints.UnauthorizedException('Must be owner of conference')
-        
+        return c_key
+
+    #Backend process to turn a SessionForm into Session properties
+    def _sessionData(self, request, c_key):
+        """Return Session properties from a SessionForm, filling defaults into both."""
+        if not request.name:
+            raise endpoints.BadRequestException("Session 'name' field required")
+
+        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeConferenceKey']
-        data['conferenceId'] = conference_id.string_id()
+        del data['websafeKey']
+        data['conferenceId'] = c_key.string_id()
         # convert dates from strings to Date objects; set month based on start_date
         if data['date']:
             data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
         if data['startTime']:
             data['startTime'] = datetime.strptime(data['startTime'][:5], "%H:%M").time()
-        # make Profile Key from user ID
-        #c_key = ndb.Key(Conference, conference_id)
-        c_key = conference_id
-        # allocate new Conference ID with Profile key as parent
-        s_id = Session.allocate_ids(size=1, parent=c_key)[0]
-        # make Conference key from ID
-        s_key = ndb.Key(Session, s_id, parent=c_key)
-        data['key'] = s_key
-        data['websafeKey'] = s_key.urlsafe()
         for df in SESSION_DEFAULTS:
             if data[df] in (None, []):
                 data[df] = SESSION_DEFAULTS[df]
                 if df != "startTime": setattr(request, df, SESSION_DEFAULTS[df])
                 else: setattr(request, df, str(SESSION_DEFAULTS[df]))
+        return data
+
+    #Backend process to group sessions by speaker
+    @staticmethod
+    def _speakerSessions(sessions):
+        """Return a dict of speaker name to the keys of their sessions."""
+        by_speaker = {}
+        for session in sessions:
+            for speaker in session.speaker:
+                if speaker and speaker != "No Speaker":
+                    by_speaker.setdefault(speaker, []).append(session.key)
+        return by_speaker
+
+    #Backend process to store new sessions
+    def _putSessions(self, c_key, sessions_data, s_keys=None):
+        """Store new Sessions in a conference from their properties, returning them.
+
+        The whole batch shares one allocate_ids (unless keys are given)
+        and one put_multi. One task then adds the sessions to their
+        speakers' indexes and checks for a new featured speaker, keeping
+        the Speaker transactions off the request. The sessions share the
+        conference's entity group, so they and the task are added in one
+        transaction: either both happen or neither does.
+        """
+        if s_keys is None:
+            s_keys = self._allocateKeys(Session, c_key, len(sessions_data))
+        sessions = []
+        for s_key, data in zip(s_keys, sessions_data):
+            sessions.append(Session(key=s_key, **data))
+        by_speaker = self._speakerSessions(sessions)
+
+        @ndb.transactional
+        def store():
+            ndb.put_multi(sessions)
+            cache.invalidate(s_keys)
+            if by_speaker:
+                indexed = set(s_key for speaker_keys in by_speaker.values() for s_key in speaker_keys)
+                taskqueue.add(params={'websafeKey': c_key.urlsafe(),
+                                      'speaker': sorted(by_speaker),
+                                      'session': [s_key.urlsafe() for s_key in s_keys
+                                                  if s_key in indexed]},
+                              url='/tasks/checkSpeaker', transactional=True)
+
+        store()
+        cache.invalidateTimetable(c_key.urlsafe())
+        return sessions
+
+    #Backend process to create a session
+    def _createSession(self, request):
+        """Add a Session, returning Session/request."""
+        c_key = self._conferenceOwnerKey(request.websafeConferenceKey)
+        data = self._sessionData(request, c_key)
         # create Session & return (modified) SessionForm
-        Session(**data).put()
-        if data['speaker'] and data['speaker'] != ["No Speaker"]:
-            taskqueue.add(params={'websafeKey': c_key.urlsafe(),
-                                  'speaker': data['speaker']},
-                                  url='/tasks/checkSpeaker')
+        session = self._putSessions(c_key, [data])[0]
+        request.websafeKey = session.key.urlsafe()
         return request
 
+    #Backend process to apply wishlist changes
+    @staticmethod
+    @ndb.transactional
+    def _applyWishlist(p_key, adds, removes):
+        """Add and remove session keys on a Profile's wishlist, returning (added, removed).
+
+        The Profile is only written if something changed.
+        """
+        profile = p_key.get()
+        wishlist = profile.sessionWishlist
+        current = set(wishlist)
+        added = [s_key for s_key in adds if s_key not in current]
+        removed = [s_key for s_key in removes if s_key in current]
+        if not added and not removed:
+            return [], []
+        removing = set(removed)
+        profile.sessionWishlist = [s_key for s_key in wishlist if s_key not in removing] + added
+        profile.put()
+        cache.invalidateProfile(p_key)
+        return added, removed
+
+    #Backend process to turn websafe session keys into Keys
+    def _sessionKeys(self, safekeys):
+        """Return the distinct Session keys of websafe keys, in order."""
+        keys = []
+        for safekey in safekeys:
+            try:
+                s_key = cache.decodeKey(safekey)
+            except Exception:
+                s_key = None
+            if not s_key or s_key.kind() != 'Session':
+                raise endpoints.BadRequestException("Not a session key: %s" % safekey)
+            if s_key not in keys:
+                keys.append(s_key)
+        return keys
+
     #Backend process for adding or removing from wishlist.
     def _wishlistChange(self, request, add=True):
         """Add or remove the session from the user's wishlist."""
-        result = None
-        message = None
         profile = self._getProfileFromUser() # get user Profile
+        session_key = self._sessionKeys([request.websafeKey])[0]
 
-        # check if conf exists given websafeConfKey
-        # get conference; check that it exists
-        session_key = request.websafeKey
-        session = ndb.Key(urlsafe=session_key).get()
-        if not session:
-            message = 'There is no session with key: %s' % (session_key)
-            result = False
-        logging.info(profile.sessionWishlist)
         # add to wishlist
         if add:
-            # See if the session is already on wishlist
-            if session_key in profile.sessionWishlist:
-                message = "This session is on your wishlist already"
-                result = False
-            # add the session to the wishlist
-            else:
-                profile.sessionWishlist.append(session_key)
-                message = "Session added to Wishlist"
-                result = True
+            # check that the session exists
+            session = cache.get(session_key)
+            if not session:
+                return WishlistResponse(
+                    message='There is no session with key: %s' % (request.websafeKey),
+                    result=False)
+            added, removed = self._applyWishlist(profile.key, [session_key], [])
+            if added:
+                # report sessions already on the wishlist at the same time
+                clashes = schedule.clashes(profile.key, profile.sessionWishlist, session)
+                return WishlistResponse(message="Session added to Wishlist", result=True,
+                                        conflicts=[s_key.urlsafe() for s_key in clashes])
+            return WishlistResponse(message="This session is on your wishlist already", result=False)
 
         # remove from wishlist
-        else:
-            # See if the session is already on wishlist
-            if session_key in profile.sessionWishlist:
-                # remove the session from wishlist
-                profile.sessionWishlist.remove(session_key)
-                message = "Session removed from Wishlist"
-                result = True
-            else:
-                message = "This session is not on your wishlist"
-                result = False
-
-        # write things back to the datastore & return
-        profile.put()
-        return WishlistResponse(message=message,result=result)
+        added, removed = self._applyWishlist(profile.key, [], [session_key])
+        if removed:
+            return WishlistResponse(message="Session removed from Wishlist", result=True)
+        return WishlistResponse(message="This session is not on your wishlist", result=False)
         
 
 #-------------------------------### Methods - Basic ###------------------------------#
@@ -565,24 +944,45 @@ class ConferenceApi(remote.Service):
    #Method that Creates a session.
     @endpoints.method(SessionForm, SessionForm, path='session/new',
             http_method='POST', name='createSession')
+    @rpcstats.instrumented
     def createSession(self, request):
         """Create new session."""
         return self._createSession(request)
 
+   #Method that creates many sessions at once.
+    @endpoints.method(SessionBatchForm, SessionForms, path='sessions/new',
+            http_method='POST', name='createSessions')
+    @rpcstats.instrumented
+    def createSessions(self, request):
+        """Create new sessions in one conference, all at once."""
+        c_key = self._conferenceOwnerKey(request.websafeConferenceKey)
+        if not request.items:
+            raise endpoints.BadRequestException("No sessions to create")
+        if len(request.items) > MAX_SESSION_BATCH:
+            raise endpoints.BadRequestException(
+                "At most %s sessions can be created at once" % MAX_SESSION_BATCH)
+        sessions = self._putSessions(
+            c_key, [self._sessionData(item, c_key) for item in request.items])
+        return SessionForms(
+            items=serializers.sessionForms(sessions)
+        )
+
     #Method that queries sessions by conference key.
     @endpoints.method(QuerySessionByKey, SessionForms,
             path='sessions/conference/all',
             http_method='GET', name='getConferenceSessions')
+    @rpcstats.instrumented
     def getConferenceSessions(self, request):
         """websafeConferenceKey -- Given a conference, return all sessions"""
         safe_key = getattr(request, "websafeConferenceKey")
-        conference_key = ndb.Key(urlsafe=safe_key)
+        conference_key = cache.decodeKey(safe_key)
         sessions = Session.query(ancestor=conference_key)
         sessions = sessions.order(Session.name)
-         # return individual Session Forms
-        return SessionForms(
-            items=[self._formatSession(session) for session in sessions]
-        )
+         # return a page of individual Session Forms, cached per conference
+        return cache.getTimetable(conference_key.urlsafe(),
+                                  self._pageSize(request.pageSize),
+                                  request.cursor,
+                                  lambda: self._sessionPage(sessions, request))
     
 #-------------------------------### Methods - Query ###------------------------------#
     
@@ -590,44 +990,43 @@ class ConferenceApi(remote.Service):
     @endpoints.method(QuerySessionByType, SessionForms,
             path='sessions/conference/type',
             http_method='GET', name='getConferenceSessionsByType')
+    @rpcstats.instrumented
     def getConferenceSessionsByType(self, request):
         """websafeConferenceKey, typeOfSession -- Given a conference, return all sessions of a specified type (eg lecture, keynote, workshop)"""
         safe_key = getattr(request, "websafeConferenceKey")
         typeOfSession = getattr(request, "typeOfSession")
-        conference_key = ndb.Key(urlsafe=safe_key)
+        conference_key = cache.decodeKey(safe_key)
         sessions = Session.query(ancestor=conference_key)
         sessions = sessions.filter(Session.typeOfSession==typeOfSession)
         sessions = sessions.order(Session.name)
-         # return individual Session Forms
-        return SessionForms(
-            items=[self._formatSession(session) for session in sessions]
-        )
+         # return a page of individual Session Forms
+        return self._sessionPage(sessions, request)
 
     #Method to query sessions by speaker    
     @endpoints.method(QuerySessionBySpeaker, SessionForms,
             path='sessions/speaker',
             http_method='GET', name='getSessionsBySpeaker')
+    @rpcstats.instrumented
     def getSessionsBySpeaker(self, request):
         """speaker -- Given a speaker, return all sessions given by this particular speaker, across all conferences"""
         speaker = getattr(request, "speaker")
         sessions = Session.query()
         sessions = sessions.filter(Session.speaker==speaker)
         sessions = sessions.order(Session.name)
-         # return individual Session Forms
-        return SessionForms(
-            items=[self._formatSession(session) for session in sessions]
-        )
+         # return a page of individual Session Forms
+        return self._sessionPage(sessions, request)
  
     #Method to query sessions by duration
     @endpoints.method(QuerySessionByDuration, SessionForms,
             path='sessions/duration',
             http_method='GET', name='getSessionsByDuration')
+    @rpcstats.instrumented
     def getSessionsByDuration(self, request):
         """Grab sessions by their duration."""
         safe_key = getattr(request, "websafeConferenceKey")
         duration = getattr(request, "duration")
         direction = getattr(request, "direction")
-        conference_key = ndb.Key(urlsafe=safe_key)
+        conference_key = cache.decodeKey(safe_key)
         sessions = Session.query(ancestor=conference_key)
         field = 'duration'
         if direction:
@@ -639,15 +1038,14 @@ class ConferenceApi(remote.Service):
         sessions = sessions.filter(queryFilter)
         sessions = sessions.order(Session.duration)
         sessions = sessions.order(Session.name)
-         # return individual Session Forms
-        return SessionForms(
-            items=[self._formatSession(session) for session in sessions]
-        )
+         # return a page of individual Session Forms
+        return self._sessionPage(sessions, request)
 
     #method to query sessions by StartTime
     @endpoints.method(QuerySessionByStartTime, SessionForms,
             path='sessions/startTime',
             http_method='GET', name='getSessionsByStartTime')
+    @rpcstats.instrumented
     def getSessionsByStartTime(self, request):
         """Get sessions by the Start Time."""
         safe_key = getattr(request, "websafeConferenceKey")
@@ -656,8 +1054,7 @@ class ConferenceApi(remote.Service):
         # NDB TimeProperty objects are internally stored as datetime equivalents. Works fine usually, but for filtering it wants a datetime object. So turn starTime into one for filtering purposes
         testTime = datetime.combine(datetime(1970,1,1), startTime)
         direction = getattr(request, "direction")
-        conference_key = ndb.Key(urlsafe=safe_key)
-        sessions = Session.query(ancestor=conference_key)
+        conference_key = cache.decodeKey(safe_key)
         sessions = Session.query(ancestor=conference_key)
         field = 'startTime'
         if direction:
@@ -670,9 +1067,57 @@ class ConferenceApi(remote.Service):
         sessions = sessions.filter(queryFilter)
         sessions = sessions.order(Session.startTime)
         sessions = sessions.order(Session.name)
-         # return individual Session Forms
-        return SessionForms(
-            items=[self._formatSession(session) for session in sessions]
+         # return a page of individual Session Forms
+        return self._sessionPage(sessions, request)
+
+    #Backend process for turning search filters into predicates
+    def _formatSessionFilters(self, filters):
+        """Parse, check validity and format user supplied session filters."""
+        predicates = []
+        for f in filters:
+            try:
+                field = search.SESSION_FIELDS[f.field]
+                op = f.operator
+                if op not in OPERATORS.values():
+                    op = OPERATORS[op]
+            except KeyError:
+                raise endpoints.BadRequestException("Filter contains invalid field or operator.")
+
+            value = f.value or ''
+            try:
+                if field == 'duration':
+                    value = int(value)
+                elif field == 'startTime':
+                    value = datetime.strptime(value[:5], "%H:%M").time()
+                elif field == 'date':
+                    value = datetime.strptime(value[:10], "%Y-%m-%d").date()
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    "Invalid value for %s: %s" % (f.field, f.value))
+            predicates.append({'field': field, 'operator': op, 'value': value})
+        return predicates
+
+    #Method to search sessions on any combination of filters
+    @endpoints.method(SessionQueryForms, SessionSearchForms,
+            path='sessions/search',
+            http_method='POST', name='searchSessions')
+    @rpcstats.instrumented
+    def searchSessions(self, request):
+        """Search sessions by type, speaker, duration, startTime and date, in any combination."""
+        predicates = self._formatSessionFilters(request.filters)
+        ancestor = None
+        if request.websafeConferenceKey:
+            ancestor = cache.decodeKey(request.websafeConferenceKey)
+        sessions, next_cursor, more, scanned = search.searchSessions(
+            predicates, ancestor=ancestor,
+            limit=self._pageSize(request.pageSize),
+            start_cursor=self._decodeCursor(request.cursor))
+        return SessionSearchForms(
+            items=serializers.sessionForms(sessions),
+            nextCursor=next_cursor.urlsafe() if next_cursor else None,
+            more=more,
+            scanned=scanned,
+            returned=len(sessions)
         )
 
 #-------------------------------### Methods - Wishlist ###------------------------------#
@@ -681,6 +1126,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SessionWebsafe, WishlistResponse,
             path='session/wishlist/add',
             http_method='GET', name='addSessionToWishlist')
+    @rpcstats.instrumented
     def addSessionToWishlist(self, request):
         """SessionKey -- adds the session to the user's list of sessions they are interested in attending."""
         return self._wishlistChange(request, add=True)
@@ -689,53 +1135,242 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SessionWebsafe, WishlistResponse,
             path='session/wishlist/remove',
             http_method='GET', name='removeSessionFromWishlist')
+    @rpcstats.instrumented
     def removeSessionFromWishlist(self, request):
         """SessionKey -- adds the session to the user's list of sessions they are interested in attending."""
         return self._wishlistChange(request, add=False)
       
     
+    #Method to add and remove many wishlist sessions at once
+    @endpoints.method(WishlistSyncForm, WishlistSyncResponse,
+            path='sessions/wishlist/sync',
+            http_method='POST', name='syncWishlist')
+    @rpcstats.instrumented
+    def syncWishlist(self, request):
+        """add, remove -- Apply many wishlist additions and removals in one go."""
+        profile = self._getProfileFromUser() # get user Profile
+        adds = self._sessionKeys(request.add)
+        removes = self._sessionKeys(request.remove)
+        both = set(adds) & set(removes)
+        if both:
+            raise endpoints.BadRequestException(
+                "Sessions both added and removed: %s" % ', '.join(s_key.urlsafe() for s_key in both))
+
+        # sessions being added must exist; removals needn't, so deleted
+        # sessions can still be taken off
+        sessions = cache.getMulti(adds)
+        missing = [s_key for s_key, session in zip(adds, sessions) if not session]
+        adds = [s_key for s_key, session in zip(adds, sessions) if session]
+        added, removed = self._applyWishlist(profile.key, adds, removes)
+        return WishlistSyncResponse(
+            added=[s_key.urlsafe() for s_key in added],
+            removed=[s_key.urlsafe() for s_key in removed],
+            missing=[s_key.urlsafe() for s_key in missing])
+
+
     @endpoints.method(message_types.VoidMessage, SessionForms,
             path='sessions/wishlist',
             http_method='GET', name='getSessionsInWishlist')
+    @rpcstats.instrumented
     def getSessionsInWishlist(self, request):
         """Get list of conferences that user has registered for."""
         profile = self._getProfileFromUser() # get user Profile
-        safekeys = profile.sessionWishlist
-        if not safekeys:
-            raise endpoints.NotFoundException("There are no sessions on your wishlist.")
-        keys = (ndb.Key(urlsafe=safekey) for safekey in safekeys)
-        logging.info(keys)
+        keys = profile.sessionWishlist
         if not keys:
             raise endpoints.NotFoundException("There are no sessions on your wishlist.")
-        sessions = ndb.get_multi(keys)
+        sessions = self._wishlistSessions(profile.key, keys, cache.getMulti(keys))
         # return set of ConferenceForm objects per Conference
-        return SessionForms(items=[self._formatSession(session) for session in sessions]
+        return SessionForms(items=serializers.sessionForms(sessions)
+        )
+
+
+    @endpoints.method(message_types.VoidMessage, WishlistConferenceForms,
+            path='sessions/wishlist/byConference',
+            http_method='GET', name='getWishlistByConference')
+    @rpcstats.instrumented
+    def getWishlistByConference(self, request):
+        """Get the sessions in the user's wishlist, grouped by conference."""
+        profile = self._getProfileFromUser() # get user Profile
+        keys = profile.sessionWishlist
+        if not keys:
+            raise endpoints.NotFoundException("There are no sessions on your wishlist.")
+        # sessions are children of their conference, so both come in one fetch
+        c_keys = []
+        for s_key in keys:
+            if s_key.parent() not in c_keys:
+                c_keys.append(s_key.parent())
+        entities = cache.getMulti(keys + c_keys)
+        sessions = self._wishlistSessions(profile.key, keys, entities[:len(keys)])
+        conferences = dict((key, conf) for key, conf in zip(c_keys, entities[len(keys):]) if conf)
+
+        # conferences in the order their first session was wishlisted
+        grouped = {}
+        order = []
+        for session in sessions:
+            c_key = session.key.parent()
+            if c_key not in conferences:
+                continue
+            if c_key not in grouped:
+                grouped[c_key] = []
+                order.append(c_key)
+            grouped[c_key].append(session)
+        available = seats.availableMulti([conferences[key] for key in order])
+        return WishlistConferenceForms(items=[WishlistConferenceForm(
+            conference=self._copyConferenceToForm(conferences[key], "", available[key]),
+            sessions=serializers.sessionForms(grouped[key])) for key in order]
         )
 
+
+    @endpoints.method(message_types.VoidMessage, WishlistConflictForms,
+            path='sessions/wishlist/conflicts',
+            http_method='GET', name='getWishlistConflicts')
+    @rpcstats.instrumented
+    def getWishlistConflicts(self, request):
+        """Get the groups of sessions in the user's wishlist whose times overlap."""
+        profile = self._getProfileFromUser() # get user Profile
+        keys = profile.sessionWishlist
+        if not keys:
+            raise endpoints.NotFoundException("There are no sessions on your wishlist.")
+        sessions = self._wishlistSessions(profile.key, keys, cache.getMulti(keys))
+        items = []
+        for group in schedule.conflicts(sessions):
+            first = schedule.interval(group[0])
+            end = max(schedule.interval(session)[1] for session in group)
+            items.append(WishlistConflictForm(
+                date=str(group[0].date),
+                startTime=first[0].strftime('%H:%M'),
+                endTime=end.strftime('%H:%M'),
+                sessions=serializers.sessionForms(group)))
+        return WishlistConflictForms(items=items)
+
+
+    #Backend process to drop deleted sessions from a wishlist
+    def _wishlistSessions(self, p_key, keys, sessions):
+        """Return the sessions of a wishlist that still exist, removing the rest from it."""
+        missing = [s_key for s_key, session in zip(keys, sessions) if not session]
+        if missing:
+            self._applyWishlist(p_key, [], missing)
+        return [session for session in sessions if session]
+
 #-------------------------------### Methods - Task Completion ###------------------------------#
 
-    #Function to query speakers. Used by the Task Queue
+    #Function to check speakers. Used by the Task Queue
     @staticmethod
-    def _speakerCheck(safe_key,speaker):
-        logging.info(speaker)
-        conference_key = ndb.Key(urlsafe=safe_key)
-        sessions = Session.query(ancestor=conference_key)
-        #sessions = Session.query()
-        sessions = sessions.filter(Session.speaker == speaker)
-        sessions = sessions.order(Session.name)
-        count = sessions.count()
-        logging.info(count)
-        if count >= 2:
-            announcement = "The current Featured Speaker is %s! He will be speaking at %s sessions." % (speaker, count)
-            memcache.set(MEMCACHE_FEATURED_KEY, announcement)
+    def _speakerCheck(safe_key, speakers, session_keys=()):
+        """Index new sessions, then feature whichever of speakers has the most sessions at a conference.
+
+        session_keys are the websafe keys of the new sessions, which are
+        added to their speakers' indexes first. Counts come from those
+        indexes, so this is one get_multi however many sessions or
+        speakers are being checked.
+        """
+        logging.info(speakers)
+        conference_key = cache.decodeKey(safe_key)
+        sessions = ndb.get_multi([ndb.Key(urlsafe=safekey) for safekey in session_keys])
+        speaker_entities = ConferenceApi._indexSpeakerSessions(
+            ConferenceApi._speakerSessions(session for session in sessions if session))
+        # read any speakers the new sessions didn't need to write
+        indexed = set(speaker_entity.name for speaker_entity in speaker_entities)
+        speaker_entities += [speaker_entity for speaker_entity in
+                             ndb.get_multi([ndb.Key(Speaker, speaker) for speaker in speakers
+                                            if speaker and speaker not in indexed])
+                             if speaker_entity]
+        best, best_count = None, 1
+        for speaker_entity in speaker_entities:
+            for c in speaker_entity.conferences:
+                if c.conferenceKey == conference_key and c.sessionCount > best_count:
+                    best, best_count = speaker_entity.name, c.sessionCount
+        logging.info("%s: %s", best, best_count)
+        if best:
+            ConferenceApi._featureSpeaker(conference_key, best, best_count)
+
+    @staticmethod
+    def _featureSpeaker(conference_key, speaker, count):
+        """Make speaker the conference's featured speaker, unless someone has more sessions."""
+        safe_key = conference_key.urlsafe()
+
+        @ndb.transactional
+        def update():
+            featured = ndb.Key(FeaturedSpeaker, safe_key).get()
+            # a speaker with as many sessions as the current one takes over
+            if featured and featured.speaker != speaker and featured.sessionCount > count:
+                return None
+            announcement = "The current Featured Speaker is %s, speaking at %s sessions!" % (speaker, count)
+            FeaturedSpeaker(id=safe_key, speaker=speaker, sessionCount=count,
+                            announcement=announcement).put()
+            return announcement
+
+        announcement = update()
+        if announcement:
+            memcache.set_multi({MEMCACHE_CONF_FEATURED_KEY % safe_key: announcement,
+                                MEMCACHE_FEATURED_KEY: announcement})
+
+    #Function to move registrations off profiles. Used by the Task Queue
+    @staticmethod
+    def _migrateRegistrations(cursor=None):
+        """Move a batch of profiles' conferenceKeysToAttend into Registrations.
+
+        Returns the cursor of the next batch, or None when done.
+        """
+        start_cursor = Cursor(urlsafe=cursor) if cursor else None
+        p_keys, next_cursor, more = Profile.query().fetch_page(
+            MIGRATION_BATCH_SIZE, start_cursor=start_cursor, keys_only=True)
+
+        @ndb.transactional
+        def migrate(p_key):
+            prof = p_key.get()
+            registrations = [Registration(
+                key=ndb.Key(Registration, safekey, parent=p_key),
+                conferenceKey=cache.decodeKey(safekey))
+                for safekey in prof.conferenceKeysToAttend]
+            prof.conferenceKeysToAttend = []
+            ndb.put_multi(registrations + [prof])
+            cache.invalidateProfile(p_key)
+
+        for prof in ndb.get_multi(p_keys):
+            if prof and prof.conferenceKeysToAttend:
+                migrate(prof.key)
+        logging.info("Migrated registrations for %s profiles", len(p_keys))
+        if more and next_cursor:
+            return next_cursor.urlsafe()
+        return None
+
+    #Function to build speaker indexes for existing sessions. Used by the Task Queue
+    @staticmethod
+    def _indexSpeakers(cursor=None):
+        """Add a batch of sessions to their speakers' indexes.
+
+        Returns the cursor of the next batch, or None when done.
+        """
+        start_cursor = Cursor(urlsafe=cursor) if cursor else None
+        sessions, next_cursor, more = Session.query().fetch_page(
+            MIGRATION_BATCH_SIZE, start_cursor=start_cursor)
+        by_speaker = ConferenceApi._speakerSessions(sessions)
+        ConferenceApi._indexSpeakerSessions(by_speaker)
+        logging.info("Indexed %s sessions for %s speakers", len(sessions), len(by_speaker))
+        if more and next_cursor:
+            return next_cursor.urlsafe()
+        return None
 
     #Method to manually get the Featured Speaker
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @endpoints.method(CONF_GET_REQUEST, StringMessage,
             path='sessions/speaker/featured',
             http_method='GET', name='getFeaturedSpeaker')
+    @rpcstats.instrumented
     def getFeaturedSpeaker(self, request):
-        """Get the featured speaker."""
-        announcement = memcache.get(MEMCACHE_FEATURED_KEY)
+        """websafeConferenceKey (optional) -- Get the featured speaker, of a conference or the latest of any."""
+        safe_key = request.websafeConferenceKey
+        if not safe_key:
+            announcement = memcache.get(MEMCACHE_FEATURED_KEY)
+        else:
+            # normalise the key so it matches what _speakerCheck stored
+            safe_key = cache.decodeKey(safe_key).urlsafe()
+            announcement = memcache.get(MEMCACHE_CONF_FEATURED_KEY % safe_key)
+            if not announcement:
+                featured = ndb.Key(FeaturedSpeaker, safe_key).get()
+                if featured:
+                    announcement = featured.announcement
+                    memcache.set(MEMCACHE_CONF_FEATURED_KEY % safe_key, announcement)
         if not announcement:
             announcement = "There are no featured speakers right now."
         return StringMessage(data=announcement)
@@ -5,20 +5,175 @@ main.py -- Controller for Taskqueue
 
 __author__ = 'veltheris@gmail.com (Dylan Mountain)'
 
+import json
+
 import webapp2
 from google.appengine.api import app_identity
+from google.appengine.api import taskqueue
 from conference import ConferenceApi
+import bulk
+import cache
+import profiling
+import registrations
+import rpcstats
 
 
 class CheckSpeaker(webapp2.RequestHandler):
     def post(self):
-        """Check if speaker has multiple sessions, adding them as featured speaker if so."""
+        """Check if speakers have multiple sessions, adding the top one as featured speaker if so."""
         # grab the key of the conference to check
         websafeKey = self.request.get('websafeKey')
-        # grab the speaker to check if featured
-        speaker = self.request.get('speaker')
-        ConferenceApi._speakerCheck(websafeKey,speaker)        
+        # grab every speaker to check if featured
+        speakers = self.request.get_all('speaker')
+        # the new sessions, to add to their speakers' indexes first
+        sessions = self.request.get_all('session')
+        ConferenceApi._speakerCheck(websafeKey, speakers, sessions)
+
+class MigrateRegistrations(webapp2.RequestHandler):
+    def get(self):
+        """Start moving registrations off profiles into Registration entities."""
+        taskqueue.add(url='/tasks/migrateRegistrations')
+        self.response.write('Registration migration started.')
+
+    def post(self):
+        """Migrate one batch of profiles, queueing the next batch if there is one."""
+        cursor = ConferenceApi._migrateRegistrations(self.request.get('cursor'))
+        if cursor:
+            taskqueue.add(params={'cursor': cursor},
+                          url='/tasks/migrateRegistrations')
+
+class IndexSpeakers(webapp2.RequestHandler):
+    def get(self):
+        """Start building Speaker indexes for existing sessions."""
+        taskqueue.add(url='/tasks/indexSpeakers')
+        self.response.write('Speaker indexing started.')
+
+    def post(self):
+        """Index one batch of sessions, queueing the next batch if there is one."""
+        cursor = ConferenceApi._indexSpeakers(self.request.get('cursor'))
+        if cursor:
+            taskqueue.add(params={'cursor': cursor},
+                          url='/tasks/indexSpeakers')
+
+class ProcessRegistrations(webapp2.RequestHandler):
+    def post(self):
+        """Register a batch of a conference's queued requests, queueing the next batch if there may be one."""
+        wsck = self.request.get('websafeConferenceKey')
+        if registrations.processBatch(wsck):
+            taskqueue.add(params={'websafeConferenceKey': wsck},
+                          url='/tasks/processRegistrations')
+
+class PromoteWaitlist(webapp2.RequestHandler):
+    def post(self):
+        """Give a conference's free seats to its waitlist."""
+        registrations.promote(self.request.get('websafeConferenceKey'))
+
+def _jobJson(job):
+    """Return the state of a bulk job as a dict."""
+    return {
+        'job': job.key.id(),
+        'mode': job.mode,
+        'kind': job.kind,
+        'format': job.format,
+        'status': job.status,
+        'chunks': job.chunkCount,
+        'rows': job.rowCount,
+        'skipped': job.skippedCount,
+        'error': job.error,
+    }
+
+class BulkImport(webapp2.RequestHandler):
+    def post(self):
+        """Upload rows to import. kind, format and organizerUserId go in the query string."""
+        kind = self.request.GET.get('kind')
+        fmt = self.request.GET.get('format', 'ndjson')
+        if kind not in bulk.FORMS or fmt not in bulk.FORMATS:
+            self.abort(400, 'kind must be Conference or Session, format ndjson or csv')
+        job = bulk.startImport(kind, fmt, self.request.body_file,
+                               self.request.GET.get('organizerUserId'))
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(_jobJson(job)))
+
+class BulkExport(webapp2.RequestHandler):
+    def post(self):
+        """Start exporting every Conference or Session."""
+        kind = self.request.get('kind')
+        fmt = self.request.get('format', 'ndjson')
+        if kind not in bulk.FORMS or fmt not in bulk.FORMATS:
+            self.abort(400, 'kind must be Conference or Session, format ndjson or csv')
+        job = bulk.startExport(kind, fmt)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(_jobJson(job)))
+
+class BulkStatus(webapp2.RequestHandler):
+    def get(self):
+        """Show the state of a bulk job."""
+        job = bulk.getJob(int(self.request.get('job') or 0))
+        if not job:
+            self.abort(404)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(_jobJson(job)))
+
+class BulkDownload(webapp2.RequestHandler):
+    def get(self):
+        """Stream the rows of a finished export."""
+        job = bulk.getJob(int(self.request.get('job') or 0))
+        if not job or job.mode != 'export':
+            self.abort(404)
+        if job.status != 'done':
+            self.abort(409, 'Export is %s' % job.status)
+        if job.format == 'csv':
+            self.response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+        else:
+            self.response.headers['Content-Type'] = 'application/x-ndjson; charset=utf-8'
+        for data in bulk.jobChunks(job):
+            self.response.write(data.encode('utf-8'))
+
+class BulkImportTask(webapp2.RequestHandler):
+    def post(self):
+        """Import the next chunk of a bulk job."""
+        retries = int(self.request.headers.get('X-AppEngine-TaskRetryCount', 0))
+        bulk.importChunk(int(self.request.get('job')), retries)
+
+class BulkExportTask(webapp2.RequestHandler):
+    def post(self):
+        """Export the next chunk of a bulk job."""
+        retries = int(self.request.headers.get('X-AppEngine-TaskRetryCount', 0))
+        bulk.exportChunk(int(self.request.get('job')), retries)
+
+class CacheStats(webapp2.RequestHandler):
+    def get(self):
+        """Show hit, miss and eviction counts for the caches."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(cache.stats(), sort_keys=True))
+
+class RpcStats(webapp2.RequestHandler):
+    def get(self):
+        """Show each API method's average RPCs per request over the last hour."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(rpcstats.stats(), sort_keys=True))
+
+class Profiles(webapp2.RequestHandler):
+    def get(self):
+        """Show the recent profiles of each API method, or of the one named by endpoint."""
+        endpoint = self.request.get('endpoint')
+        endpoints = [endpoint] if endpoint else rpcstats.ENDPOINTS
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(profiling.recent(endpoints), sort_keys=True))
 
 app = webapp2.WSGIApplication([
     ('/tasks/checkSpeaker', CheckSpeaker),
+    ('/tasks/migrateRegistrations', MigrateRegistrations),
+    ('/tasks/indexSpeakers', IndexSpeakers),
+    ('/tasks/processRegistrations', ProcessRegistrations),
+    ('/tasks/promoteWaitlist', PromoteWaitlist),
+    ('/tasks/bulk/import', BulkImportTask),
+    ('/tasks/bulk/export', BulkExportTask),
+    ('/admin/bulk/import', BulkImport),
+    ('/admin/bulk/export', BulkExport),
+    ('/admin/bulk/status', BulkStatus),
+    ('/admin/bulk/download', BulkDownload),
+    ('/admin/cacheStats', CacheStats),
+    ('/admin/rpcStats', RpcStats),
+    ('/admin/profiles', Profiles),
 ], debug=True)
@@ -23,11 +23,50 @@ class oProfile(ndb.Model):
 
 class Profile(ndb.Model):
     """Profile -- User profile object"""
+    # profiles are cached by cache.getProfile rather than by NDB
+    _use_memcache = False
+
     displayName             = ndb.StringProperty()
     mainEmail               = ndb.StringProperty()
     teeShirtSize            = ndb.StringProperty(default='NOT_SPECIFIED')
+    # registrations are kept as Registration entities; this list is only
+    # read until /tasks/migrateRegistrations has moved it over
     conferenceKeysToAttend  = ndb.StringProperty(repeated=True)
-    sessionWishlist         = ndb.StringProperty(repeated=True)
+    sessionWishlist         = ndb.KeyProperty(kind='Session', repeated=True,
+                                              name='wishlistKeys')
+    # the wishlist as websafe strings, as it was stored before it held Keys;
+    # moved over to sessionWishlist the first time the profile is loaded
+    legacyWishlist          = ndb.StringProperty(repeated=True, name='sessionWishlist')
+
+class Registration(ndb.Model):
+    """Registration -- A Profile's registration for a Conference.
+
+    Child of the Profile, with the websafe conference key as its id.
+    """
+    conferenceKey   = ndb.KeyProperty(kind='Conference')
+
+class RegistrationRequest(ndb.Model):
+    """RegistrationRequest -- A queued request to register for a Conference.
+
+    Child of the Profile, with the client's idempotency token as its id.
+    status is the name of a RegistrationStatus.
+    """
+    conferenceKey   = ndb.KeyProperty(kind='Conference')
+    status          = ndb.StringProperty(default='QUEUED')
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class WaitlistEntry(ndb.Model):
+    """WaitlistEntry -- A Profile waiting for a seat at a full Conference.
+
+    Child of Key('Waitlist', websafe conference key), with the Profile's
+    id as its id, so a conference's whole waitlist is one entity group.
+    Requests the profile sends while waiting keep its place, and are
+    given the same outcome as requestKey.
+    """
+    joined          = ndb.DateTimeProperty()
+    requestKey      = ndb.KeyProperty(kind='RegistrationRequest', indexed=False)
+    laterRequestKeys = ndb.KeyProperty(kind='RegistrationRequest', repeated=True, indexed=False)
+
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -72,7 +111,16 @@ class Conference(ndb.Model):
     month           = ndb.IntegerProperty()
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
+    # seatsAvailable is only kept up to date while seatShards is 0; once a
+    # conference is sharded its seats live in SeatShard entities (see seats.py)
     seatsAvailable  = ndb.IntegerProperty()
+    seatShards      = ndb.IntegerProperty(default=0)
+
+
+class SeatShard(ndb.Model):
+    """SeatShard -- One slice of a Conference's available seats"""
+    conferenceKey   = ndb.KeyProperty(kind='Conference')
+    seats           = ndb.IntegerProperty(default=0, indexed=False)
 
 
 class ConferenceForm(messages.Message):
@@ -93,7 +141,9 @@ class ConferenceForm(messages.Message):
     
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
-    items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    items       = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextCursor  = messages.StringField(2)
+    more        = messages.BooleanField(3)
 
 
 class ConferenceQueryForm(messages.Message):
@@ -105,7 +155,9 @@ class ConferenceQueryForm(messages.Message):
 
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
-    filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    filters     = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize    = messages.IntegerField(2)
+    cursor      = messages.StringField(3)
 
 
 # needed for conference registration
@@ -114,6 +166,23 @@ class BooleanMessage(messages.Message):
     data = messages.BooleanField(1)
 
 
+class RegistrationStatus(messages.Enum):
+    """RegistrationStatus -- state of a queued registration enumeration value"""
+    QUEUED = 1
+    REGISTERED = 2
+    WAITLISTED = 3
+    CANCELLED = 4
+    FAILED = 5
+
+
+class RegistrationStatusForm(messages.Message):
+    """RegistrationStatusForm -- Queued registration outbound form message"""
+    websafeConferenceKey    = messages.StringField(1)
+    token                   = messages.StringField(2)
+    status                  = messages.EnumField('RegistrationStatus', 3)
+    waitlistPosition        = messages.IntegerField(4)
+
+
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
@@ -134,7 +203,31 @@ class Session(ndb.Model):
     duration        = ndb.IntegerProperty()
     date            = ndb.DateProperty()
     startTime       = ndb.TimeProperty()
-    websafeKey      = ndb.StringProperty()
+
+
+class SpeakerConference(ndb.Model):
+    """SpeakerConference -- A Speaker's number of sessions at one Conference"""
+    conferenceKey   = ndb.KeyProperty(kind='Conference', indexed=False)
+    sessionCount    = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class Speaker(ndb.Model):
+    """Speaker -- A speaker's number of Sessions at each Conference, keyed by the speaker's name"""
+    name            = ndb.StringProperty()
+    # sessions counted before SpeakerSession rows; no longer added to
+    sessionKeys     = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+    conferences     = ndb.StructuredProperty(SpeakerConference, repeated=True)
+
+
+class SpeakerSession(ndb.Model):
+    """SpeakerSession -- A Session counted by its Speaker, child of the Speaker keyed by websafe session key"""
+
+
+class FeaturedSpeaker(ndb.Model):
+    """FeaturedSpeaker -- A Conference's featured speaker, keyed by websafe conference key"""
+    speaker         = ndb.StringProperty(indexed=False)
+    sessionCount    = ndb.IntegerProperty(default=0, indexed=False)
+    announcement    = ndb.StringProperty(indexed=False)
 
 
 class SessionForm(messages.Message):
@@ -152,9 +245,17 @@ class SessionForm(messages.Message):
     
 class SessionForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
-    items = messages.MessageField(SessionForm, 1, repeated=True)
+    items       = messages.MessageField(SessionForm, 1, repeated=True)
+    nextCursor  = messages.StringField(2)
+    more        = messages.BooleanField(3)
 
     
+class SessionBatchForm(messages.Message):
+    """SessionBatchForm -- Many sessions of one conference inbound form message"""
+    websafeConferenceKey    = messages.StringField(1)
+    items                   = messages.MessageField(SessionForm, 2, repeated=True)
+
+
 class SessionWebsafe(messages.Message):
     """SessionWebsafe -- a key to find a session"""
     websafeKey          = messages.StringField(1)
@@ -163,17 +264,23 @@ class SessionWebsafe(messages.Message):
 class QuerySessionByKey(messages.Message):
     """QuerySessionByKey -- Accepts a websafe conference key."""
     websafeConferenceKey    = messages.StringField(1)
+    pageSize                = messages.IntegerField(2)
+    cursor                  = messages.StringField(3)
 
     
 class QuerySessionByType(messages.Message):
     """QuerySessionByType -- Accepts a websafe conference key and a session type."""
     websafeConferenceKey    = messages.StringField(1)
     typeOfSession           = messages.StringField(2)
+    pageSize                = messages.IntegerField(3)
+    cursor                  = messages.StringField(4)
 
 
 class QuerySessionBySpeaker(messages.Message):
     """QuerySessionBySpeaker -- Accepts a speaker."""
-    speaker    = messages.StringField(1)
+    speaker                 = messages.StringField(1)
+    pageSize                = messages.IntegerField(2)
+    cursor                  = messages.StringField(3)
 
 
 class QuerySessionByDuration(messages.Message):
@@ -181,6 +288,8 @@ class QuerySessionByDuration(messages.Message):
     websafeConferenceKey    = messages.StringField(1)
     duration                = messages.IntegerField(2)
     direction               = messages.BooleanField(3)
+    pageSize                = messages.IntegerField(4)
+    cursor                  = messages.StringField(5)
 
 
 class QuerySessionByStartTime(messages.Message):
@@ -188,14 +297,106 @@ class QuerySessionByStartTime(messages.Message):
     websafeConferenceKey    = messages.StringField(1)
     startTime               = messages.StringField(2)
     direction               = messages.BooleanField(3)
+    pageSize                = messages.IntegerField(4)
+    cursor                  = messages.StringField(5)
+
+
+class SessionQueryForm(messages.Message):
+    """SessionQueryForm -- Session search predicate inbound form message"""
+    field       = messages.StringField(1)
+    operator    = messages.StringField(2)
+    value       = messages.StringField(3)
+
+
+class SessionQueryForms(messages.Message):
+    """SessionQueryForms -- multiple SessionQueryForm inbound form message"""
+    filters                 = messages.MessageField(SessionQueryForm, 1, repeated=True)
+    websafeConferenceKey    = messages.StringField(2)
+    pageSize                = messages.IntegerField(3)
+    cursor                  = messages.StringField(4)
+
+
+class SessionSearchForms(messages.Message):
+    """SessionSearchForms -- Session search outbound form message"""
+    items       = messages.MessageField(SessionForm, 1, repeated=True)
+    nextCursor  = messages.StringField(2)
+    more        = messages.BooleanField(3)
+    scanned     = messages.IntegerField(4)
+    returned    = messages.IntegerField(5)
 
 
 class WishlistResponse(messages.Message):
     """WishListResponse -- Returns a message and a exit code."""
     message                 = messages.StringField(1)
     result                = messages.BooleanField(2)
+    conflicts               = messages.StringField(3, repeated=True)
+
+    
+class WishlistConferenceForm(messages.Message):
+    """WishlistConferenceForm -- A Conference and its wishlist Sessions outbound form message"""
+    conference              = messages.MessageField(ConferenceForm, 1)
+    sessions                = messages.MessageField(SessionForm, 2, repeated=True)
+
+
+class WishlistConferenceForms(messages.Message):
+    """WishlistConferenceForms -- Wishlist Sessions grouped by Conference outbound form message"""
+    items                   = messages.MessageField(WishlistConferenceForm, 1, repeated=True)
+
+
+class WishlistConflictForm(messages.Message):
+    """WishlistConflictForm -- Wishlist Sessions with overlapping times outbound form message"""
+    date                    = messages.StringField(1)
+    startTime               = messages.StringField(2)
+    endTime                 = messages.StringField(3)
+    sessions                = messages.MessageField(SessionForm, 4, repeated=True)
+
+
+class WishlistConflictForms(messages.Message):
+    """WishlistConflictForms -- multiple WishlistConflictForm outbound form message"""
+    items                   = messages.MessageField(WishlistConflictForm, 1, repeated=True)
+
+
+class WishlistSyncForm(messages.Message):
+    """WishlistSyncForm -- Wishlist additions and removals inbound form message"""
+    add                     = messages.StringField(1, repeated=True)
+    remove                  = messages.StringField(2, repeated=True)
+
+
+class WishlistSyncResponse(messages.Message):
+    """WishlistSyncResponse -- Wishlist changes made outbound form message"""
+    added                   = messages.StringField(1, repeated=True)
+    removed                 = messages.StringField(2, repeated=True)
+    missing                 = messages.StringField(3, repeated=True)
 
     
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
-    data = messages.StringField(1, required=True)
\ No newline at end of file
+    data = messages.StringField(1, required=True)
+
+
+####################
+##  Bulk Models   ##
+####################
+
+
+class BulkJob(ndb.Model):
+    """BulkJob -- A bulk import or export of Conferences or Sessions"""
+    mode            = ndb.StringProperty(choices=['import', 'export'])
+    kind            = ndb.StringProperty(choices=['Conference', 'Session'])
+    format          = ndb.StringProperty(choices=['ndjson', 'csv'])
+    organizerUserId = ndb.StringProperty(indexed=False)
+    status          = ndb.StringProperty(default='running')
+    chunkCount      = ndb.IntegerProperty(default=0, indexed=False)
+    nextChunk       = ndb.IntegerProperty(default=0, indexed=False)
+    cursor          = ndb.StringProperty(indexed=False)
+    rowCount        = ndb.IntegerProperty(default=0, indexed=False)
+    skippedCount    = ndb.IntegerProperty(default=0, indexed=False)
+    error           = ndb.TextProperty()
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class BulkChunk(ndb.Model):
+    """BulkChunk -- A run of rows of a BulkJob, child of the job, numbered from 1"""
+    data            = ndb.TextProperty()
+    # keys given to an import chunk's rows, saved before they are written
+    keys            = ndb.KeyProperty(repeated=True, indexed=False)
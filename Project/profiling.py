@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""profiling.py
+
+Opt-in cProfile profiling of ConferenceApi methods.
+
+A request is profiled when its PROFILE_HEADER header matches
+settings.PROFILING_TOKEN, or at random for a settings.PROFILING_SAMPLE_RATE
+fraction of requests. Both are off by default, and other requests pay
+only for the check.
+
+rpcstats.instrumented starts the profiler and saves the result once the
+method has returned. The TOP_FUNCTIONS functions by cumulative time are
+kept in memcache, along with the request's latency and RPC counts, in a
+list of each endpoint's RECENT_PROFILES latest profiles. recent()
+returns them for the /admin/profiles handler.
+
+"""
+
+import cProfile
+import logging
+import os
+import pstats
+import random
+import StringIO
+
+from google.appengine.api import memcache
+
+import settings
+
+
+PROFILE_HEADER = 'X-Conference-Profile'
+
+TOP_FUNCTIONS = 25
+RECENT_PROFILES = 10
+
+MEMCACHE_PROFILES_KEY = "Profiles:%s"
+PROFILES_CACHE_TIME = 86400
+
+# attempts at adding a profile before giving up on it
+CAS_RETRIES = 3
+
+
+def _headers(service):
+    """Return the request headers of an API service instance, or None."""
+    try:
+        return service.request_state.headers
+    except AttributeError:
+        return None
+
+
+def _reason(service):
+    """Return why the current request should be profiled, or None."""
+    token = getattr(settings, 'PROFILING_TOKEN', None)
+    if token:
+        headers = _headers(service)
+        if headers is not None and headers.get(PROFILE_HEADER) == token:
+            return 'header'
+    rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+    if rate and random.random() < rate:
+        return 'sample'
+    return None
+
+
+def start(service):
+    """Return a Profile to run the request with if it is to be profiled, else None."""
+    reason = _reason(service)
+    if not reason:
+        return None
+    profiler = cProfile.Profile()
+    profiler.reason = reason
+    return profiler
+
+
+def _function(key):
+    """Return a pstats function key as 'file:line(name)', with a short file name."""
+    filename, line, name = key
+    if filename != '~':
+        filename = os.path.join(*filename.split(os.sep)[-2:])
+    return '%s:%s(%s)' % (filename, line, name)
+
+
+def top(profiler, limit=TOP_FUNCTIONS):
+    """Return the limit functions with the most cumulative time in a profile."""
+    stats = pstats.Stats(profiler, stream=StringIO.StringIO())
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+    return [{
+        'function': _function(key),
+        'calls': calls,
+        'primitiveCalls': primitive,
+        'ms': round(total * 1000, 3),
+        'cumulativeMs': round(cumulative * 1000, 3),
+    } for key, (primitive, calls, total, cumulative, callers) in rows[:limit]]
+
+
+def save(endpoint, profiler, summary):
+    """Add a finished profile to the endpoint's recent profiles.
+
+    summary is the request's rpcstats summary.
+    """
+    profile = {
+        'endpoint': endpoint,
+        'reason': profiler.reason,
+        'ms': summary['ms'],
+        'error': summary['error'],
+        'services': summary['services'],
+        'functions': top(profiler),
+    }
+    logging.info("Profiled %s (%s): %sms", endpoint, profiler.reason, summary['ms'])
+
+    cache_key = MEMCACHE_PROFILES_KEY % endpoint
+    client = memcache.Client()
+    for i in range(CAS_RETRIES):
+        profiles = client.gets(cache_key)
+        if profiles is None:
+            if client.add(cache_key, [profile], time=PROFILES_CACHE_TIME):
+                return
+            continue
+        profiles = [profile] + profiles[:RECENT_PROFILES - 1]
+        if client.cas(cache_key, profiles, time=PROFILES_CACHE_TIME):
+            return
+    logging.warning("Dropped a profile of %s after %s attempts", endpoint, CAS_RETRIES)
+
+
+def recent(endpoints):
+    """Return {endpoint: its recent profiles, newest first} for the given endpoints."""
+    found = memcache.get_multi([MEMCACHE_PROFILES_KEY % endpoint for endpoint in endpoints])
+    return dict((endpoint, found[MEMCACHE_PROFILES_KEY % endpoint])
+                for endpoint in endpoints
+                if MEMCACHE_PROFILES_KEY % endpoint in found)
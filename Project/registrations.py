@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+
+"""registrations.py
+
+Queued registration for conferences, with a waitlist once they are full.
+
+request() saves a RegistrationRequest, a child of the Profile keyed by a
+token the client picks, so sending the same request twice is harmless.
+In the same transaction it adds a pull task tagged with the conference.
+A push task then leases up to BATCH_SIZE of that conference's pull tasks
+and registers them one after another. A rush of registrations is taken
+a batch at a time by one worker, rather than every request contending
+for the seat shards at once.
+
+Once the conference is full, the rest of the batch joins its waitlist.
+Entries are WaitlistEntry children of Key('Waitlist', websafe conference
+key), written in one transaction per batch and read in the order they
+joined. Whenever a registration gives a seat back, a task promotes the
+waitlist, giving seats to whoever has waited longest.
+
+"""
+
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import Registration
+from models import RegistrationRequest
+from models import WaitlistEntry
+import cache
+import seats
+
+
+QUEUE_NAME = 'registrations'
+BATCH_SIZE = 100
+LEASE_SECONDS = 60
+
+PROCESS_URL = '/tasks/processRegistrations'
+PROMOTE_URL = '/tasks/promoteWaitlist'
+
+# a conference's queued requests are processed at most once a second
+PROCESS_DELAY = 1
+
+# waitlist entries read per query while promoting
+PROMOTE_BATCH = 20
+
+
+class _AlreadyRegistered(Exception):
+    """Raised inside a seat claim to abort it when no seat is needed."""
+
+
+def waitlistKey(wsck):
+    """Return the key of the (entity-less) parent of a conference's waitlist."""
+    return ndb.Key('Waitlist', wsck)
+
+
+def _entryKey(wsck, p_key):
+    return ndb.Key(WaitlistEntry, p_key.id(), parent=waitlistKey(wsck))
+
+
+def _registrationKey(wsck, p_key):
+    return ndb.Key(Registration, wsck, parent=p_key)
+
+
+def hasWaitlistAsync(wsck):
+    """Return a future for whether anyone is waiting for a seat at a conference."""
+    return WaitlistEntry.query(ancestor=waitlistKey(wsck)).get_async(keys_only=True)
+
+
+#--------------------------------### Requests ###--------------------------------------------------#
+
+def _trigger(wsck):
+    """Make sure a task processes a conference's queued requests shortly."""
+    # one task per conference per second takes every request queued in it
+    second = int(time.time())
+    name = 'registrations-%s-%d' % (hashlib.sha1(wsck.encode('utf-8')).hexdigest()[:20], second)
+    try:
+        taskqueue.add(url=PROCESS_URL, params={'websafeConferenceKey': wsck},
+                      name=name, countdown=PROCESS_DELAY)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def request(p_key, c_key, token):
+    """Queue a registration for a conference under token, returning its RegistrationRequest.
+
+    If token has been used before, the request it was used for is
+    returned instead, whichever conference it was for.
+    """
+    wsck = c_key.urlsafe()
+    req_key = ndb.Key(RegistrationRequest, token, parent=p_key)
+
+    @ndb.transactional
+    def add():
+        req = req_key.get()
+        if req:
+            return req
+        req = RegistrationRequest(key=req_key, conferenceKey=c_key)
+        req.put()
+        taskqueue.Queue(QUEUE_NAME).add(
+            taskqueue.Task(payload=req_key.urlsafe(), method='PULL', tag=wsck),
+            transactional=True)
+        return req
+
+    req = add()
+    if req.status == 'QUEUED':
+        _trigger(wsck)
+    return req
+
+
+def processBatch(wsck):
+    """Register a batch of a conference's queued requests, returning whether there may be more."""
+    queue = taskqueue.Queue(QUEUE_NAME)
+    tasks = queue.lease_tasks_by_tag(LEASE_SECONDS, BATCH_SIZE, tag=wsck)
+    if not tasks:
+        return False
+    try:
+        _process(wsck, [ndb.Key(urlsafe=task.payload) for task in tasks])
+    except Exception:
+        # hand the tasks straight back, for the retried push task to lease
+        for task in tasks:
+            queue.modify_task_lease(task, 0)
+        raise
+    queue.delete_tasks(tasks)
+    return len(tasks) == BATCH_SIZE
+
+
+def _process(wsck, req_keys):
+    """Register or waitlist the still queued requests among req_keys, in order."""
+    # a pull task can be delivered more than once
+    unique = []
+    for req_key in req_keys:
+        if req_key not in unique:
+            unique.append(req_key)
+    reqs = [req for req in ndb.get_multi(unique) if req and req.status == 'QUEUED']
+    if not reqs:
+        return
+
+    conf = cache.decodeKey(wsck).get()
+    if not conf:
+        for req in reqs:
+            req.status = 'FAILED'
+        ndb.put_multi(reqs)
+        return
+
+    registered = ndb.get_multi([_registrationKey(wsck, req.key.parent()) for req in reqs])
+    # nobody takes a seat ahead of those already waiting for one
+    full = hasWaitlistAsync(wsck).get_result() is not None
+    done = []
+    waiting = []
+    claimed = 0
+    for req, registration in zip(reqs, registered):
+        if registration:
+            req.status = 'REGISTERED'
+            done.append(req)
+        elif not full and _claimFor(conf, req):
+            claimed += 1
+        else:
+            full = True
+            waiting.append(req)
+    if done:
+        ndb.put_multi(done)
+    if waiting:
+        _joinWaitlist(wsck, waiting)
+    if claimed:
+        cache.invalidateConferenceQueries()
+    logging.info("Registrations for %s: %s registered, %s waitlisted",
+                 wsck, claimed + len(done), len(waiting))
+
+
+def _claimFor(conf, req):
+    """Take a seat for a queued request, returning False if the conference is full."""
+    r_key = _registrationKey(conf.key.urlsafe(), req.key.parent())
+
+    def register():
+        # runs in the same transaction as taking the seat
+        if r_key.get():
+            raise _AlreadyRegistered()
+        Registration(key=r_key, conferenceKey=conf.key).put()
+        req.status = 'REGISTERED'
+        req.put()
+
+    try:
+        return seats.claim(conf, register)
+    except _AlreadyRegistered:
+        req.status = 'REGISTERED'
+        req.put()
+        return True
+
+
+def _joinWaitlist(wsck, reqs):
+    """Put the profiles of reqs at the end of a conference's waitlist, in order."""
+    keys = [_entryKey(wsck, req.key.parent()) for req in reqs]
+
+    @ndb.transactional
+    def join():
+        # keep the place of anyone already waiting, with the new request
+        # riding on it
+        entries = dict((e.key, e) for e in ndb.get_multi(keys) if e)
+        changed = {}
+        now = datetime.utcnow()
+        for i, (key, req) in enumerate(zip(keys, reqs)):
+            entry = entries.get(key)
+            if not entry:
+                entry = entries[key] = WaitlistEntry(
+                    key=key, requestKey=req.key, joined=now + timedelta(microseconds=i))
+            elif req.key not in _requestKeys(entry):
+                entry.laterRequestKeys.append(req.key)
+            else:
+                continue
+            changed[key] = entry
+        ndb.put_multi(changed.values())
+
+    join()
+    for req in reqs:
+        req.status = 'WAITLISTED'
+    ndb.put_multi(reqs)
+
+
+#--------------------------------### Waitlist ###--------------------------------------------------#
+
+def _requestKeys(entry):
+    """Return the keys of every request waiting on a waitlist entry."""
+    keys = [entry.requestKey] if entry.requestKey else []
+    return keys + entry.laterRequestKeys
+
+
+def _settle(entry, status, only=None):
+    """Give the requests waiting on a waitlist entry a status, in the profile's entity group.
+
+    If only is given, just the requests with that status are changed.
+    """
+    reqs = [req for req in ndb.get_multi(_requestKeys(entry))
+            if req and (only is None or req.status == only)]
+    for req in reqs:
+        req.status = status
+    ndb.put_multi(reqs)
+
+
+def queuePromotion(wsck):
+    """Queue a promotion of a conference's waitlist, in the current transaction if there is one."""
+    taskqueue.add(url=PROMOTE_URL, params={'websafeConferenceKey': wsck},
+                  transactional=ndb.in_transaction())
+
+
+def _promote(conf, entry):
+    """Give a seat to a waitlisted profile, returning False if there is none to give."""
+    wsck = conf.key.urlsafe()
+    r_key = _registrationKey(wsck, ndb.Key(Profile, entry.key.id()))
+
+    def register():
+        # runs in the same transaction as taking the seat
+        if not entry.key.get() or r_key.get():
+            raise _AlreadyRegistered()
+        Registration(key=r_key, conferenceKey=conf.key).put()
+        entry.key.delete()
+        _settle(entry, 'REGISTERED')
+
+    try:
+        return seats.claim(conf, register)
+    except _AlreadyRegistered:
+        # left the waitlist, or registered some other way, meanwhile
+        entry.key.delete()
+        if r_key.get():
+            _settle(entry, 'REGISTERED', only='WAITLISTED')
+        return True
+
+
+def promote(wsck):
+    """Give a conference's free seats to its longest waiting, returning how many moved up."""
+    conf = cache.decodeKey(wsck).get()
+    if not conf:
+        return 0
+    promoted = 0
+    query = WaitlistEntry.query(ancestor=waitlistKey(wsck)).order(WaitlistEntry.joined)
+    while True:
+        entries = query.fetch(PROMOTE_BATCH)
+        for entry in entries:
+            if not _promote(conf, entry):
+                entries = None
+                break
+            promoted += 1
+        if not entries:
+            break
+    if promoted:
+        cache.invalidateConferenceQueries()
+    return promoted
+
+
+@ndb.transactional(xg=True)
+def leaveWaitlist(wsck, p_key):
+    """Take a profile off a conference's waitlist, returning whether it was on it."""
+    entry = _entryKey(wsck, p_key).get()
+    if not entry:
+        return False
+    entry.key.delete()
+    _settle(entry, 'CANCELLED')
+    return True
+
+
+def waitlistPosition(wsck, p_key):
+    """Return a profile's place on a conference's waitlist, counting from 1, or None."""
+    entry = _entryKey(wsck, p_key).get()
+    if not entry:
+        return None
+    ahead = WaitlistEntry.query(ancestor=waitlistKey(wsck)).filter(
+        WaitlistEntry.joined < entry.joined).count()
+    return ahead + 1
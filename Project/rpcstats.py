@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+"""rpcstats.py
+
+Counts the API calls each ConferenceApi method makes.
+
+Every RPC the app makes (datastore_v3, memcache, taskqueue, ...) passes
+through the apiproxy call hooks installed here. While a method wrapped
+with instrumented is running, its thread has a Collector recording each
+call's count, latency and how many entities or items it carried. When
+the method returns, its totals are logged as one JSON line and added to
+rolling per-endpoint aggregates in memcache.
+
+The aggregates are kept in WINDOW second buckets, and are added to
+memcache from each instance every FLUSH_EVERY requests (or FLUSH_TIME
+seconds) rather than costing an RPC per request. stats() sums the last
+BUCKETS buckets, for the /admin/rpcStats handler.
+
+"""
+
+import functools
+import json
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+import profiling
+
+
+# services given their own aggregates; every service is in the log line
+SERVICES = ('datastore_v3', 'memcache', 'taskqueue')
+FIELDS = ('requests', 'ms') + tuple('%s.%s' % (service, field)
+                                    for service in SERVICES
+                                    for field in ('calls', 'ms', 'entities'))
+
+MEMCACHE_RPCSTATS_KEY = "RpcStats:%s:%s:%s"
+WINDOW = 300
+BUCKETS = 12
+
+FLUSH_EVERY = 20
+FLUSH_TIME = 60
+
+# names of every instrumented method, in the order they were defined
+ENDPOINTS = []
+
+_local = threading.local()
+_pending = {}
+_pending_requests = [0, time.time()]
+_pending_lock = threading.Lock()
+
+
+class Collector(object):
+    """Collector -- The RPCs made while handling one request."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.time()
+        # 'service.call' -> [count, seconds, entities]
+        self.calls = {}
+        # rpc -> time it was made
+        self.pending = {}
+
+    def record(self, service, call, seconds, entities):
+        """Count one finished RPC."""
+        totals = self.calls.setdefault('%s.%s' % (service, call), [0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] += entities
+
+    def summary(self, error=None):
+        """Return the request's totals as a dict, by call and by service."""
+        calls = {}
+        services = {}
+        for name, (count, seconds, entities) in self.calls.items():
+            calls[name] = {'count': count, 'ms': round(seconds * 1000, 1),
+                           'entities': entities}
+            service = services.setdefault(name.split('.', 1)[0],
+                                          {'calls': 0, 'ms': 0.0, 'entities': 0})
+            service['calls'] += count
+            service['ms'] += seconds * 1000
+            service['entities'] += entities
+        for service in services.values():
+            service['ms'] = round(service['ms'], 1)
+        return {
+            'endpoint': self.endpoint,
+            'ms': round((time.time() - self.started) * 1000, 1),
+            'error': error,
+            'calls': calls,
+            'services': services,
+        }
+
+
+#--------------------------------### Hooks ###--------------------------------------------------#
+
+def _rpcId(service, call, rpc):
+    """Return what a call is known by between its pre and post hooks."""
+    # synchronous calls have no rpc, but can't overlap on one thread
+    return id(rpc) if rpc is not None else (service, call)
+
+
+def _entityCount(service, call, request, response):
+    """Return how many entities or items an RPC carried, where that's known."""
+    try:
+        if service == 'datastore_v3':
+            if call == 'Get':
+                return response.entity_size()
+            if call in ('RunQuery', 'Next'):
+                return response.result_size()
+            if call == 'Put':
+                return request.entity_size()
+            if call == 'Delete':
+                return request.key_size()
+        elif service == 'memcache':
+            if call == 'Get':
+                return response.item_size()
+            if call in ('Set', 'Delete', 'BatchIncrement'):
+                return request.item_size()
+            if call == 'Increment':
+                return 1
+        elif service == 'taskqueue' and call == 'BulkAdd':
+            return request.add_request_size()
+    except AttributeError:
+        pass
+    return 0
+
+
+def _preCall(service, call, request, response, rpc):
+    collector = getattr(_local, 'collector', None)
+    if collector is not None:
+        collector.pending[_rpcId(service, call, rpc)] = time.time()
+
+
+def _postCall(service, call, request, response, rpc, error):
+    collector = getattr(_local, 'collector', None)
+    if collector is None:
+        return
+    started = collector.pending.pop(_rpcId(service, call, rpc), None)
+    seconds = time.time() - started if started else 0.0
+    collector.record(service, call, seconds,
+                     _entityCount(service, call, request, response))
+
+
+def install():
+    """Add the call hooks to the current apiproxy.
+
+    Done on import; call again after replacing the apiproxy, as testbed
+    does. Adding them twice has no effect.
+    """
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('rpcstats', _preCall)
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('rpcstats', _postCall)
+
+
+install()
+
+
+#--------------------------------### Requests ###--------------------------------------------------#
+
+def instrumented(method):
+    """Decorator collecting the RPCs an API method makes.
+
+    Goes between @endpoints.method and the def. A method called from
+    another instrumented method counts towards the outer one. Requests
+    profiling.py picks are also run under its profiler.
+    """
+    name = method.__name__
+    ENDPOINTS.append(name)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if getattr(_local, 'collector', None) is not None:
+            return method(*args, **kwargs)
+        profiler = profiling.start(args[0] if args else None)
+        collector = _local.collector = Collector(name)
+        error = None
+        try:
+            if profiler:
+                return profiler.runcall(method, *args, **kwargs)
+            return method(*args, **kwargs)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _local.collector = None
+            summary = _finish(collector, error)
+            # saved outside the collector, so it isn't counted as the method's
+            if profiler:
+                profiling.save(name, profiler, summary)
+    return wrapper
+
+
+def last():
+    """Return the summary of the last request finished on this thread, or None."""
+    return getattr(_local, 'last', None)
+
+
+def _finish(collector, error):
+    """Log a finished request's totals and add them to the aggregates, returning them."""
+    summary = _local.last = collector.summary(error)
+    logging.info("rpcstats %s", json.dumps(summary, sort_keys=True))
+
+    counts = {'requests': 1, 'ms': int(round(summary['ms']))}
+    for service in SERVICES:
+        totals = summary['services'].get(service)
+        if totals:
+            counts[service + '.calls'] = totals['calls']
+            counts[service + '.ms'] = int(round(totals['ms']))
+            counts[service + '.entities'] = totals['entities']
+    bucket = int(time.time()) // WINDOW
+
+    with _pending_lock:
+        for field, n in counts.items():
+            key = MEMCACHE_RPCSTATS_KEY % (bucket, collector.endpoint, field)
+            _pending[key] = _pending.get(key, 0) + n
+        _pending_requests[0] += 1
+        if (_pending_requests[0] < FLUSH_EVERY and
+                time.time() - _pending_requests[1] < FLUSH_TIME):
+            return summary
+        pending = dict(_pending)
+        _pending.clear()
+        _pending_requests[:] = [0, time.time()]
+    _flush(pending)
+    return summary
+
+
+def _flush(pending):
+    """Add pending counts to memcache, where they expire after the window."""
+    # add_multi only creates the missing keys, giving them an expiry
+    memcache.add_multi(dict.fromkeys(pending, 0), time=WINDOW * (BUCKETS + 1))
+    memcache.offset_multi(pending, initial_value=0)
+
+
+#--------------------------------### Aggregates ###--------------------------------------------------#
+
+def stats():
+    """Return each endpoint's requests over the last BUCKETS windows, with means per request."""
+    bucket = int(time.time()) // WINDOW
+    keys = [MEMCACHE_RPCSTATS_KEY % (b, endpoint, field)
+            for b in range(bucket - BUCKETS + 1, bucket + 1)
+            for endpoint in ENDPOINTS
+            for field in FIELDS]
+    totals = {}
+    for key, value in memcache.get_multi(keys).items():
+        prefix, b, endpoint, field = key.split(':', 3)
+        endpoint_totals = totals.setdefault(endpoint, {})
+        endpoint_totals[field] = endpoint_totals.get(field, 0) + int(value)
+
+    endpoints = {}
+    for endpoint, counts in totals.items():
+        requests = counts.get('requests', 0)
+        if not requests:
+            continue
+        result = {'requests': requests,
+                  'ms': round(float(counts.get('ms', 0)) / requests, 1)}
+        for service in SERVICES:
+            result[service] = dict(
+                (field, round(float(counts.get('%s.%s' % (service, field), 0)) / requests, 2))
+                for field in ('calls', 'ms', 'entities'))
+        endpoints[endpoint] = result
+    return {'windowSeconds': WINDOW * BUCKETS, 'endpoints': endpoints}
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""schedule.py
+
+Clashes between the sessions on a wishlist.
+
+A session with a date, start time and duration takes up the interval
+from its start to start + duration minutes. conflicts() sorts a
+wishlist's intervals by start and sweeps through them once, grouping
+sessions that overlap, so n sessions are checked in O(n log n) rather
+than pair by pair. Sessions missing any of the three are left out.
+
+clashes() checks one session as it is added to a wishlist. Each
+wishlist's sorted intervals are kept on the instance, keyed by the
+profile and the wishlist's contents, so the sessions already on it are
+only fetched when the wishlist has changed some other way.
+
+"""
+
+import bisect
+from datetime import datetime, timedelta
+
+import cache
+
+
+INTERVAL_CACHE_SIZE = 1000
+INTERVAL_CACHE_TIME = 600
+
+# profile key, tuple of wishlist keys -> (sorted (start, end, session key), their starts)
+_wishlists = cache.LRUCache(INTERVAL_CACHE_SIZE, ttl=INTERVAL_CACHE_TIME)
+
+
+def interval(session):
+    """Return (start, end, key) of a session as datetimes, or None if it isn't scheduled."""
+    if session.date is None or session.startTime is None or not session.duration:
+        return None
+    start = datetime.combine(session.date, session.startTime)
+    return start, start + timedelta(minutes=session.duration), session.key
+
+
+def intervals(sessions):
+    """Return the intervals of the scheduled sessions, sorted by start."""
+    found = [interval(session) for session in sessions]
+    return sorted([i for i in found if i], key=lambda i: i[:2])
+
+
+def conflicts(sessions):
+    """Return the groups of sessions whose times overlap, each sorted by start.
+
+    Two sessions are in the same group if they overlap, or both overlap
+    a third. A session ending as another starts doesn't clash with it.
+    """
+    by_key = dict((session.key, session) for session in sessions)
+    groups = []
+    group, group_end = [], None
+    for start, end, key in intervals(sessions):
+        if group and start < group_end:
+            group.append(key)
+            group_end = max(group_end, end)
+            continue
+        if len(group) > 1:
+            groups.append(group)
+        group, group_end = [key], end
+    if len(group) > 1:
+        groups.append(group)
+    return [[by_key[key] for key in group] for group in groups]
+
+
+def _overlapping(index, starts, start, end):
+    """Return the keys of the intervals in a sorted index that overlap start to end.
+
+    starts is the start of each interval in index, in the same order.
+    """
+    # only intervals starting before end can overlap it
+    stop = bisect.bisect_left(starts, end)
+    return [key for i_start, i_end, key in index[:stop] if i_end > start]
+
+
+def clashes(p_key, wishlist, session):
+    """Return the keys of the sessions on wishlist that overlap session.
+
+    wishlist is the profile's wishlist before session was added to it;
+    the result is also cached for the wishlist with session added.
+    """
+    cached = _wishlists.get((p_key, tuple(wishlist)))
+    if cached is None:
+        index = intervals([s for s in cache.getMulti(wishlist) if s])
+        starts = [i[0] for i in index]
+    else:
+        index, starts = cached
+    new = interval(session)
+    if new is None:
+        found = []
+    else:
+        found = [key for key in _overlapping(index, starts, new[0], new[1])
+                 if key != session.key]
+        at = bisect.bisect(index, new)
+        index = index[:at] + [new] + index[at:]
+        starts = starts[:at] + [new[0]] + starts[at:]
+    if session.key not in wishlist:
+        _wishlists.set((p_key, tuple(wishlist) + (session.key,)), (index, starts))
+    return found
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""search.py
+
+Session search over any mix of predicates.
+
+The datastore only allows inequality filters on a single property, and
+treats != on a repeated property as "has some other value". plan() picks
+the most selective predicate the datastore can answer on its own; the
+rest are checked in Python while results stream past, stopping as soon
+as a page is full or the scan budget runs out.
+
+A predicate is a dict with 'field' (a Session property name), 'operator'
+(one of =, !=, <, <=, >, >=) and 'value' (already of the property's type).
+
+"""
+
+import itertools
+import operator
+from datetime import datetime
+
+from google.appengine.ext import ndb
+
+from models import Session
+
+
+# API field names of the searchable Session properties
+SESSION_FIELDS = {
+    'TYPE': 'typeOfSession',
+    'SPEAKER': 'speaker',
+    'DURATION': 'duration',
+    'START_TIME': 'startTime',
+    'DATE': 'date',
+}
+
+REPEATED_FIELDS = ('typeOfSession', 'speaker')
+
+# how selective an equality filter on each field tends to be; lower is
+# better. A range filter is always ranked after every equality.
+EQUALITY_RANK = {
+    'speaker': 0,
+    'startTime': 1,
+    'date': 2,
+    'duration': 3,
+    'typeOfSession': 4,
+}
+RANGE_RANK = {
+    'startTime': 10,
+    'date': 11,
+    'duration': 12,
+}
+
+COMPARISONS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+# most entities a single search request will read
+MAX_SCAN = 1000
+
+
+def _rank(predicate):
+    """Return how good a predicate is to hand to the datastore, or None."""
+    if predicate['operator'] == '=':
+        return EQUALITY_RANK.get(predicate['field'])
+    # != is an inequality on both sides of the value, and on a repeated
+    # property doesn't mean "doesn't contain", so it is never pushed down
+    if predicate['operator'] == '!=':
+        return None
+    return RANGE_RANK.get(predicate['field'])
+
+
+def plan(predicates):
+    """Split predicates into (the one to push to the datastore or None, the rest)."""
+    ranked = [(_rank(p), i) for i, p in enumerate(predicates)
+              if _rank(p) is not None]
+    if not ranked:
+        return (None, list(predicates))
+    best = min(ranked)[1]
+    return (predicates[best],
+            [p for i, p in enumerate(predicates) if i != best])
+
+
+def _filterNode(predicate):
+    """Return a query filter for a pushed down predicate."""
+    value = predicate['value']
+    # TimeProperty is stored as a datetime on 1970-01-01, and DateProperty
+    # as a datetime at midnight; filters need to compare against those
+    if predicate['field'] == 'startTime':
+        value = datetime.combine(datetime(1970, 1, 1), value)
+    elif predicate['field'] == 'date':
+        value = datetime.combine(value, datetime.min.time())
+    return ndb.query.FilterNode(predicate['field'], predicate['operator'], value)
+
+
+def matches(session, predicate):
+    """Return whether session satisfies predicate."""
+    compare = COMPARISONS[predicate['operator']]
+    value = getattr(session, predicate['field'])
+    if predicate['field'] in REPEATED_FIELDS:
+        if predicate['operator'] == '!=':
+            return predicate['value'] not in value
+        return any(compare(v, predicate['value']) for v in value)
+    if value is None:
+        return False
+    return compare(value, predicate['value'])
+
+
+def _scan(entities, counter, max_scan):
+    """Yield entities, counting them, until max_scan have been read."""
+    for entity in entities:
+        counter[0] += 1
+        yield entity
+        if counter[0] >= max_scan:
+            return
+
+
+def _postFilter(entities, predicates):
+    """Yield the entities satisfying every predicate."""
+    for entity in entities:
+        if all(matches(entity, p) for p in predicates):
+            yield entity
+
+
+def searchSessions(predicates, ancestor=None, limit=20, start_cursor=None,
+                   max_scan=MAX_SCAN):
+    """Search Sessions, returning (sessions, next cursor, more, scanned).
+
+    At most limit sessions are returned and max_scan read. The cursor
+    continues the scan after the last session read, matching or not.
+    """
+    pushed, remaining = plan(predicates)
+    query = Session.query(ancestor=ancestor)
+    if pushed:
+        query = query.filter(_filterNode(pushed))
+
+    iterator = query.iter(produce_cursors=True, start_cursor=start_cursor,
+                          batch_size=min(limit * 2, max_scan))
+    counter = [0]
+    sessions = list(itertools.islice(
+        _postFilter(_scan(iterator, counter, max_scan), remaining), limit))
+
+    scanned = counter[0]
+    if not scanned or not iterator.probably_has_next():
+        return (sessions, None, False, scanned)
+    return (sessions, iterator.cursor_after(), True, scanned)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Sharded seat counters for conference registration.
+
+A conference's available seats are split across several SeatShard
+entities, each in its own entity group. Registering takes a seat from a
+randomly chosen shard, so attendees of a popular conference don't all
+contend on the one Conference entity. A shard never drops below zero,
+so the conference can't be oversold.
+
+"""
+
+import random
+
+from google.appengine.ext import ndb
+from google.appengine.api import memcache
+
+from models import SeatShard
+import cache
+
+
+NUM_SHARDS = 10
+
+# the summed seat count is cached, and dropped whenever a seat changes hands
+MEMCACHE_SEATS_KEY = "Seats:%s"
+SEATS_CACHE_TIME = 60
+
+
+def _shardKeys(conf_key, count):
+    """Return the keys of a conference's seat shards."""
+    prefix = conf_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s-%d' % (prefix, i)) for i in range(count)]
+
+
+def makeShards(conf_key, seats, count=NUM_SHARDS):
+    """Return (unsaved) shards splitting seats evenly across count shards."""
+    base, extra = divmod(max(seats, 0), count)
+    return [SeatShard(key=key, conferenceKey=conf_key,
+                      seats=base + (1 if i < extra else 0))
+            for i, key in enumerate(_shardKeys(conf_key, count))]
+
+
+@ndb.transactional(xg=True)
+def _shardConference(conf_key):
+    """Move an unsharded conference's seatsAvailable into seat shards."""
+    conf = conf_key.get()
+    if conf.seatShards:
+        return conf
+    shards = makeShards(conf_key, conf.seatsAvailable or 0)
+    conf.seatShards = len(shards)
+    ndb.put_multi([conf] + shards)
+    cache.invalidateConference(conf_key)
+    return conf
+
+
+def ensureShards(conf):
+    """Return conf, sharding its seats first if that hasn't happened yet."""
+    if conf.seatShards:
+        return conf
+    return _shardConference(conf.key)
+
+
+def _forgetCache(conf_key):
+    """Drop the cached seat count, so the next read sums the shards again."""
+    memcache.delete(MEMCACHE_SEATS_KEY % conf_key.urlsafe())
+
+
+@ndb.transactional(xg=True)
+def _claimFrom(shard_key, onClaim):
+    """Take a seat from one shard, running onClaim in the same transaction."""
+    shard = shard_key.get()
+    if not shard or shard.seats <= 0:
+        return False
+    onClaim()
+    shard.seats -= 1
+    shard.put()
+    return True
+
+
+def claim(conf, onClaim):
+    """Take one seat of conf, returning False if it is sold out.
+
+    onClaim is called inside the transaction that takes the seat, so
+    whatever it writes is committed only if the seat is taken. Any
+    exception it raises aborts the claim.
+    """
+    if not conf.seatShards and (conf.seatsAvailable or 0) <= 0:
+        return False
+    conf = ensureShards(conf)
+
+    # try the shards that looked open, in random order, so concurrent
+    # registrations spread across them
+    shards = ndb.get_multi(_shardKeys(conf.key, conf.seatShards))
+    open_keys = [shard.key for shard in shards if shard and shard.seats > 0]
+    random.shuffle(open_keys)
+    for shard_key in open_keys:
+        if _claimFrom(shard_key, onClaim):
+            _forgetCache(conf.key)
+            return True
+    return False
+
+
+@ndb.transactional(xg=True)
+def _releaseTo(shard_key, conf_key, onRelease):
+    """Give a seat back to one shard if onRelease says one was freed."""
+    if not onRelease():
+        return False
+    shard = shard_key.get()
+    if not shard:
+        shard = SeatShard(key=shard_key, conferenceKey=conf_key, seats=0)
+    shard.seats += 1
+    shard.put()
+    return True
+
+
+def release(conf, onRelease):
+    """Give one seat of conf back, returning whether one was given back.
+
+    onRelease is called inside the transaction and returns whether a seat
+    was actually freed.
+    """
+    conf = ensureShards(conf)
+    shard_key = random.choice(_shardKeys(conf.key, conf.seatShards))
+    released = _releaseTo(shard_key, conf.key, onRelease)
+    if released:
+        _forgetCache(conf.key)
+    return released
+
+
+def availableMulti(confs):
+    """Return a dict of conference key to the number of seats available."""
+    result = {}
+    sharded = []
+    for conf in confs:
+        if conf.seatShards:
+            sharded.append(conf)
+        else:
+            result[conf.key] = conf.seatsAvailable
+    if not sharded:
+        return result
+
+    # use the cached totals where there are any, and sum the shards otherwise
+    cache_keys = dict((MEMCACHE_SEATS_KEY % conf.key.urlsafe(), conf)
+                      for conf in sharded)
+    cached = memcache.get_multi(cache_keys.keys())
+    missing = []
+    for cache_key, conf in cache_keys.items():
+        if cache_key in cached:
+            result[conf.key] = cached[cache_key]
+        else:
+            missing.append(conf)
+    if missing:
+        shard_keys = []
+        for conf in missing:
+            shard_keys.extend(_shardKeys(conf.key, conf.seatShards))
+        counts = {}
+        for shard in ndb.get_multi(shard_keys):
+            if shard:
+                counts[shard.conferenceKey] = counts.get(shard.conferenceKey, 0) + shard.seats
+        totals = {}
+        for conf in missing:
+            result[conf.key] = counts.get(conf.key, 0)
+            totals[MEMCACHE_SEATS_KEY % conf.key.urlsafe()] = result[conf.key]
+        memcache.add_multi(totals, time=SEATS_CACHE_TIME)
+    return result
+
+
+def available(conf):
+    """Return the number of seats available for conf."""
+    return availableMulti([conf])[conf.key]
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""serializers.py
+
+Copy Profile, Conference and Session entities to their outbound forms.
+
+Which form fields come from which entity attributes, and how each is
+converted, is worked out once at import time. Copying an entity is then
+one attrgetter call, the conversions that field needs, and one form
+constructor, without looping over all_fields() or checking hasattr and
+field names for every entity.
+
+"""
+
+import operator
+
+from models import Profile
+from models import ProfileForm
+from models import TeeShirtSize
+from models import Conference
+from models import ConferenceForm
+from models import Session
+from models import SessionForm
+
+
+class Serializer(object):
+    """Serializer -- Copies one model's entities to one form class.
+
+    Every form field that is also an attribute of the model is copied,
+    through converters[name] if there is one. Fields in skip are left
+    for the caller to fill in.
+    """
+
+    def __init__(self, model, form_class, converters=None, skip=()):
+        converters = converters or {}
+        self.form_class = form_class
+        self.names = tuple(f.name for f in sorted(form_class.all_fields(),
+                                                  key=lambda f: f.number)
+                           if hasattr(model, f.name) and f.name not in skip)
+        self._get = operator.attrgetter(*self.names)
+        self._converters = tuple((i, converters[name])
+                                 for i, name in enumerate(self.names)
+                                 if name in converters)
+
+    def values(self, entity):
+        """Return a dict of form field values for entity."""
+        values = self._get(entity)
+        # attrgetter of a single name doesn't return a tuple
+        values = list(values) if len(self.names) > 1 else [values]
+        for i, convert in self._converters:
+            values[i] = convert(values[i])
+        return dict(zip(self.names, values))
+
+    def toForm(self, entity, **extra):
+        """Return a form for entity, with extra fields set as given."""
+        values = self.values(entity)
+        values.update(extra)
+        return self.form_class(**values)
+
+
+PROFILE = Serializer(Profile, ProfileForm, {
+    # convert t-shirt string to Enum
+    'teeShirtSize': lambda size: getattr(TeeShirtSize, size),
+})
+
+# dates and times become their str(); that includes None becoming 'None'
+CONFERENCE = Serializer(Conference, ConferenceForm, {
+    'startDate': str,
+    'endDate': str,
+}, skip=('seatsAvailable',))
+
+SESSION = Serializer(Session, SessionForm, {
+    'date': str,
+    'startTime': str,
+})
+
+
+def sessionForms(sessions):
+    """Return a SessionForm for each Session."""
+    values = SESSION.values
+    return [SessionForm(websafeConferenceKey=session.key.parent().urlsafe(),
+                        websafeKey=session.key.urlsafe(),
+                        **values(session))
+            for session in sessions]
@@ -10,3 +10,9 @@ Replace with own to be able to deploy to web.
 # Console or Cloud Console.
 #WEB_CLIENT_ID = 'replace with Web client ID'
 WEB_CLIENT_ID = '729917132891-l2lsduab3jqvhk870663vi7r2qidpie0.apps.googleusercontent.com'
+
+# Profiling of API methods (see profiling.py). Requests sending the
+# X-Conference-Profile header with this token are profiled, as is a random
+# PROFILING_SAMPLE_RATE fraction of all requests. Both are off when unset.
+PROFILING_TOKEN = None
+PROFILING_SAMPLE_RATE = 0.0
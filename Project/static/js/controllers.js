@@ -424,11 +424,24 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Invokes the conference.queryConferences API.
+     * Number of conferences asked for per queryConferences call.
+     * @type {number}
+     */
+    $scope.queryPageSize = 100;
+
+    /**
+     * Counts the queries started, so pages of an earlier query are ignored.
+     * @type {number}
+     */
+    $scope.queryId = 0;
+
+    /**
+     * Invokes the conference.queryConferences API, following nextCursor until every page is loaded.
      */
     $scope.queryConferencesAll = function () {
         var sendFilters = {
-            filters: []
+            filters: [],
+            pageSize: $scope.queryPageSize
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -440,32 +453,52 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                 });
             }
         }
+        var queryId = ++$scope.queryId;
         $scope.loading = true;
-        gapi.client.conference.queryConferences(sendFilters).
-            execute(function (resp) {
-                $scope.$apply(function () {
-                    $scope.loading = false;
-                    if (resp.error) {
-                        // The request has failed.
-                        var errorMessage = resp.error.message || '';
-                        $scope.messages = 'Failed to query conferences : ' + errorMessage;
-                        $scope.alertStatus = 'warning';
-                        $log.error($scope.messages + ' filters : ' + JSON.stringify(sendFilters));
-                    } else {
+        $scope.conferences = [];
+        $scope.pagination.currentPage = 0;
+
+        var fetchPage = function (cursor) {
+            var request = angular.extend({}, sendFilters);
+            if (cursor) {
+                request.cursor = cursor;
+            }
+            gapi.client.conference.queryConferences(request).
+                execute(function (resp) {
+                    $scope.$apply(function () {
+                        if (queryId != $scope.queryId) {
+                            // a newer query has been started
+                            return;
+                        }
+                        if (resp.error) {
+                            // The request has failed.
+                            $scope.loading = false;
+                            var errorMessage = resp.error.message || '';
+                            $scope.messages = 'Failed to query conferences : ' + errorMessage;
+                            $scope.alertStatus = 'warning';
+                            $log.error($scope.messages + ' filters : ' + JSON.stringify(sendFilters));
+                            $scope.submitted = true;
+                            return;
+                        }
                         // The request has succeeded.
+                        angular.forEach(resp.items, function (conference) {
+                            $scope.conferences.push(conference);
+                        });
+                        if (resp.more && resp.nextCursor) {
+                            // keep loading the next page
+                            fetchPage(resp.nextCursor);
+                            return;
+                        }
+                        $scope.loading = false;
                         $scope.submitted = false;
                         $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
-
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
-                        });
-                    }
-                    $scope.submitted = true;
+                        $scope.submitted = true;
+                    });
                 });
-            });
+        };
+        fetchPage(null);
     }
 
     /**
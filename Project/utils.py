@@ -1,12 +1,110 @@
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from models import Profile
+import cache
 
-def getUserId(user, id_type="email"):
+# token -> user id, looked up with the tokeninfo endpoint and kept until
+# the token expires, locally and then in memcache
+TOKEN_CACHE_SIZE = 1000
+MEMCACHE_TOKEN_KEY = "TokenUser:%s"
+# used when tokeninfo doesn't say when a token expires, and as a cap
+DEFAULT_TOKEN_TIME = 300
+MAX_TOKEN_TIME = 3600
+
+_tokens = cache.LRUCache(TOKEN_CACHE_SIZE)
+# token digest -> _Lookup in progress, so concurrent requests with the
+# same token wait for one lookup rather than each making their own
+_lookups = {}
+_lookups_lock = threading.Lock()
+
+
+class _Lookup(object):
+    """_Lookup -- One lookup of a token, shared by the requests waiting on it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.done = False
+        self.user_id = None
+
+
+def _fetchTokenInfo(token, token_type, fetch):
+    """Return the tokeninfo endpoint's answer for a token, or {} if there is none."""
+    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+           % (token_type, token))
+    user = {}
+    wait = 1
+    for i in range(3):
+        resp = fetch(url)
+        if resp.status_code == 200:
+            user = json.loads(resp.content)
+            break
+        elif resp.status_code == 400 and 'invalid_token' in resp.content:
+            url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+                   % ('access_token', token))
+        else:
+            time.sleep(wait)
+            wait = wait + i
+    return user
+
+
+def _lookupToken(digest, token, token_type, fetch):
+    """Return the user id of a token from memcache or tokeninfo, caching it locally."""
+    cache_key = MEMCACHE_TOKEN_KEY % digest
+    cached = memcache.get(cache_key)
+    if cached:
+        user_id, expires = cached
+    else:
+        user = _fetchTokenInfo(token, token_type, fetch)
+        user_id = user.get('user_id', '')
+        try:
+            ttl = min(int(user.get('expires_in', DEFAULT_TOKEN_TIME)), MAX_TOKEN_TIME)
+        except ValueError:
+            ttl = DEFAULT_TOKEN_TIME
+        expires = time.time() + ttl
+        # failed lookups aren't cached
+        if user_id and ttl > 0:
+            memcache.set(cache_key, (user_id, expires), time=ttl)
+    ttl = expires - time.time()
+    if user_id and ttl > 0:
+        _tokens.set(digest, user_id, ttl)
+    return user_id
+
+
+def _tokenUserId(token, token_type, fetch):
+    """Return the user id a token belongs to, from the caches if possible."""
+    digest = hashlib.sha256(token).hexdigest()
+    user_id = _tokens.get(digest)
+    if user_id is not None:
+        return user_id
+
+    with _lookups_lock:
+        lookup = _lookups.setdefault(digest, _Lookup())
+    try:
+        with lookup.lock:
+            # requests that waited share the answer, even a failed one,
+            # rather than each retrying tokeninfo in turn
+            if not lookup.done:
+                lookup.user_id = _lookupToken(digest, token, token_type, fetch)
+                lookup.done = True
+            return lookup.user_id
+    finally:
+        with _lookups_lock:
+            if _lookups.get(digest) is lookup:
+                del _lookups[digest]
+
+
+def getUserId(user, id_type="email", fetch=None):
+    """Return the id of user.
+
+    For the oauth id_type, fetch stands in for urlfetch.fetch when given.
+    """
     if id_type == "email":
         return user.email()
 
@@ -17,22 +115,7 @@ def getUserId(user, id_type="email"):
         token_type = 'id_token'
         if 'OAUTH_USER_ID' in os.environ:
             token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _tokenUserId(token, token_type, fetch or urlfetch.fetch)
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm
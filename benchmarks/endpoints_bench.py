@@ -0,0 +1,657 @@
+#!/usr/bin/env python
+
+"""endpoints_bench.py
+
+Benchmark of every ConferenceApi method, run against the App Engine
+testbed's local datastore_v3, memcache and taskqueue stubs.
+
+A synthetic dataset is built through the API itself: profiles,
+conferences, sessions, registrations and wishlists, in the sizes given
+on the command line. Every API method is then called --iterations times
+with randomized (but seeded, so repeatable) arguments. For each method
+the report gives latency percentiles, the RPCs made per call (counted
+by Project/rpcstats.py) and errors; peak memory is the process's
+maximum resident set size.
+
+Results are written as JSON. Giving --compare a previous results file
+prints each method's change against it and exits with status 1 if any
+method got slower than --threshold times its old median, or makes more
+RPCs per call than it did.
+
+The testbed stubs answer every RPC as soon as it is made, so RPCs that
+a method overlaps cost no less than ones it waits on in turn. --latency
+MS makes each RPC take MS milliseconds from when it is made until it
+is answered. Whoever first waits on it sleeps out whatever is left, so
+RPCs made together are waited for together, as against the real
+services. --serial instead makes every RPC wait out its latency as soon
+as it is made, as if nothing overlapped. Comparing the two runs shows
+what overlapping saves. The report's rounds column is how many times a
+call had to wait.
+
+Run with the App Engine SDK's Python 2.7:
+
+    GAE_SDK=/path/to/google_appengine python benchmarks/endpoints_bench.py \\
+        --conferences 20 --sessions 30 --profiles 50 --output new.json \\
+        --compare old.json
+
+--input compares an existing results file instead of running again.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+import timeit
+import weakref
+from datetime import date, timedelta
+
+PROJECT = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'Project'))
+sys.path.insert(0, PROJECT)
+sdk = os.environ.get('GAE_SDK')
+if sdk:
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+import endpoints
+from protorpc import message_types
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference
+from models import ConferenceForm
+from models import ConferenceQueryForm
+from models import ConferenceQueryForms
+from models import ProfileMiniForm
+from models import TeeShirtSize
+from models import SessionForm
+from models import SessionBatchForm
+from models import SessionWebsafe
+from models import QuerySessionByKey
+from models import QuerySessionByType
+from models import QuerySessionBySpeaker
+from models import QuerySessionByDuration
+from models import QuerySessionByStartTime
+from models import SessionQueryForm
+from models import SessionQueryForms
+from models import WishlistSyncForm
+from conference import ConferenceApi
+from conference import CONF_GET_REQUEST
+from conference import REGISTRATION_REQUEST
+import rpcstats
+
+
+CITIES = ['London', 'Paris', 'Tokyo', 'Chicago', 'Berlin']
+TOPICS = ['Web', 'Cloud', 'Mobile', 'Data', 'Security']
+SESSION_TYPES = ['lecture', 'keynote', 'workshop']
+DURATIONS = [30, 45, 60, 90]
+PERCENTILES = (50, 90, 99)
+
+AUTH_DOMAIN = 'example.com'
+
+
+#--------------------------------### Environment ###--------------------------------------------------#
+
+def setUp():
+    """Activate a testbed with the stubs the API uses, returning it."""
+    tb = testbed.Testbed()
+    tb.activate()
+    # every query sees every write, as the app expects of ancestor queries
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+    tb.init_datastore_v3_stub(consistency_policy=policy)
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=PROJECT)
+    # the testbed replaced the apiproxy the hooks were added to
+    rpcstats.install()
+    return tb
+
+
+def login(user):
+    """Make user the signed in endpoints user."""
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = user
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = AUTH_DOMAIN
+
+
+def newRequest():
+    """Start what the API sees as a new request."""
+    # each request gets an empty NDB in-context cache
+    ndb.get_context().clear_cache()
+
+
+def flushTasks(tb):
+    """Drop queued tasks, so they don't pile up in memory."""
+    stub = tb.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    for queue in stub.GetQueues():
+        stub.FlushQueue(queue['name'])
+
+
+def peakRss():
+    """Return the process's peak resident set size in KB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, OS X bytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+#--------------------------------### Latency ###--------------------------------------------------#
+
+class Latency(object):
+    """Latency -- Simulated RPC latency on top of the synchronous testbed stubs.
+
+    Each RPC made through a UserRPC is due seconds after it was made, and
+    whoever first waits on it sleeps until then. Calls made without one
+    are synchronous, and sleep straight away, as do all calls if serial.
+    """
+
+    def __init__(self, ms, serial=False):
+        self.seconds = ms / 1000.0
+        self.serial = serial
+        # low level rpc -> when it is answered
+        self.due = weakref.WeakKeyDictionary()
+        # times something slept waiting for an answer
+        self.rounds = 0
+        self.originals = None
+
+    def _sleepUntil(self, due):
+        wait = due - time.time()
+        if wait > 0:
+            self.rounds += 1
+            time.sleep(wait)
+
+    def _preCall(self, service, call, request, response, rpc):
+        if rpc is None or self.serial:
+            self._sleepUntil(time.time() + self.seconds)
+        else:
+            self.due[rpc] = time.time() + self.seconds
+
+    def _dueOf(self, user_rpc):
+        rpc = getattr(user_rpc, '_UserRPC__rpc', None)
+        return self.due.get(rpc) if rpc is not None else None
+
+    def _answer(self, user_rpc):
+        """Sleep until user_rpc is answered, if it hasn't been yet."""
+        rpc = getattr(user_rpc, '_UserRPC__rpc', None)
+        due = self.due.pop(rpc, None) if rpc is not None else None
+        if due is not None:
+            self._sleepUntil(due)
+
+    def install(self):
+        """Add the hook and wrap UserRPC's waits; call after activating the testbed."""
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('latency', self._preCall)
+        if self.originals:
+            return
+        user_rpc = apiproxy_stub_map.UserRPC
+        # as defined on the class, to put back as they were
+        self.originals = (vars(user_rpc)['wait'], vars(user_rpc)['wait_any'])
+        wait, wait_any = user_rpc.wait, user_rpc.wait_any
+        latency = self
+
+        def waitFor(rpc_self):
+            wait(rpc_self)
+            latency._answer(rpc_self)
+
+        def waitForAny(cls, rpcs):
+            rpcs = list(rpcs)
+            finished = wait_any(rpcs)
+            if finished is None:
+                return None
+            # the stubs have answered them all; the one due first comes first
+            due = [r for r in rpcs if latency._dueOf(r) is not None]
+            if due:
+                finished = min(due, key=latency._dueOf)
+            latency._answer(finished)
+            return finished
+
+        user_rpc.wait = waitFor
+        user_rpc.wait_any = classmethod(waitForAny)
+
+    def uninstall(self):
+        """Put UserRPC's waits back."""
+        if self.originals:
+            apiproxy_stub_map.UserRPC.wait, apiproxy_stub_map.UserRPC.wait_any = self.originals
+            self.originals = None
+
+
+#--------------------------------### Dataset ###--------------------------------------------------#
+
+class Dataset(object):
+    """Dataset -- The synthetic profiles, conferences and sessions, and their keys."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.users = []
+        self.conferences = []
+        self.sessions = []
+        self.speakers = []
+        self.registrations = set()
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def conference(self):
+        return self.rng.choice(self.conferences)
+
+    def session(self):
+        return self.rng.choice(self.sessions)
+
+    def speaker(self):
+        return self.rng.choice(self.speakers)
+
+
+def conferenceForm(rng, i):
+    """Return a ConferenceForm for a new conference."""
+    start = date(2027, 1, 1) + timedelta(days=rng.randrange(365))
+    return ConferenceForm(
+        name='Conference %d' % i,
+        description='Synthetic conference %d' % i,
+        topics=rng.sample(TOPICS, 2),
+        city=rng.choice(CITIES),
+        startDate=str(start),
+        endDate=str(start + timedelta(days=2)),
+        maxAttendees=100000)
+
+
+def sessionForm(rng, i, speakers):
+    """Return a SessionForm for a new session."""
+    return SessionForm(
+        name='Session %d' % i,
+        typeOfSession=[rng.choice(SESSION_TYPES)],
+        highlights=['Highlight %d' % i],
+        speaker=[rng.choice(speakers)],
+        duration=rng.choice(DURATIONS),
+        date=str(date(2027, 1, 1) + timedelta(days=rng.randrange(365))),
+        startTime='%02d:%02d' % (rng.randrange(8, 18), rng.choice([0, 30])))
+
+
+def build(tb, api, args, rng):
+    """Create the dataset through the API, returning it."""
+    data = Dataset(rng)
+    data.speakers = ['Speaker %d' % i
+                     for i in range(max(5, args.conferences * args.sessions // 3))]
+
+    for i in range(args.profiles):
+        user = 'user%d@%s' % (i, AUTH_DOMAIN)
+        login(user)
+        api.getProfile(message_types.VoidMessage())
+        data.users.append(user)
+
+    for i in range(args.conferences):
+        login(data.users[i % len(data.users)])
+        api.createConference(conferenceForm(rng, i))
+    # createConference doesn't return the new key
+    data.conferences = [c_key.urlsafe() for c_key in
+                        Conference.query().fetch(keys_only=True)]
+
+    for i, wsck in enumerate(data.conferences):
+        # sessions are added by the conference's organizer
+        login(ndb.Key(urlsafe=wsck).parent().string_id())
+        forms = api.createSessions(SessionBatchForm(
+            websafeConferenceKey=wsck,
+            items=[sessionForm(rng, i * args.sessions + j, data.speakers)
+                   for j in range(args.sessions)]))
+        data.sessions.extend(form.websafeKey for form in forms.items)
+        # what /tasks/checkSpeaker would do
+        ConferenceApi._speakerCheck(wsck, sorted(set(
+            speaker for form in forms.items for speaker in form.speaker)),
+            [form.websafeKey for form in forms.items])
+        flushTasks(tb)
+    # what the /tasks/indexSpeakers backfill would do after a deploy
+    cursor = ConferenceApi._indexSpeakers()
+    while cursor:
+        cursor = ConferenceApi._indexSpeakers(cursor)
+
+    for user in data.users:
+        login(user)
+        for wsck in rng.sample(data.conferences, min(args.registrations, len(data.conferences))):
+            api.registerForConference(CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=wsck))
+            data.registrations.add((user, wsck))
+        for s_key in rng.sample(data.sessions, min(args.wishlist, len(data.sessions))):
+            api.addSessionToWishlist(SessionWebsafe(websafeKey=s_key))
+    flushTasks(tb)
+    return data
+
+
+#--------------------------------### Scenarios ###--------------------------------------------------#
+
+def unregisteredPair(data):
+    """Return a user and a conference they aren't registered for, or None."""
+    for i in range(100):
+        pair = (data.user(), data.conference())
+        if pair not in data.registrations:
+            data.registrations.add(pair)
+            return pair
+    return None
+
+
+def scenarios(api, data, rng):
+    """Return {method name: function making one call of it}.
+
+    Each function signs a user in, builds its request and returns a
+    callable making the call, so only the call itself is timed.
+    """
+    def asUser(user, method, request):
+        login(user)
+        return lambda: method(request)
+
+    def conference(**kwargs):
+        return CONF_GET_REQUEST.combined_message_class(**kwargs)
+
+    def register():
+        user, wsck = unregisteredPair(data) or (data.user(), data.conference())
+        return asUser(user, api.registerForConference, conference(websafeConferenceKey=wsck))
+
+    def unregister():
+        pairs = sorted(data.registrations)
+        user, wsck = pairs[rng.randrange(len(pairs))]
+        data.registrations.discard((user, wsck))
+        return asUser(user, api.unregisterFromConference, conference(websafeConferenceKey=wsck))
+
+    requested = []
+
+    def requestRegistration():
+        user, wsck = data.user(), data.conference()
+        token = 'bench-%d' % next(counter)
+        requested.append((user, wsck, token))
+        return asUser(user, api.requestRegistration,
+                      REGISTRATION_REQUEST.combined_message_class(
+                          websafeConferenceKey=wsck, token=token))
+
+    def registrationStatus():
+        if not requested:
+            requestRegistration()()
+        user, wsck, token = rng.choice(requested)
+        return asUser(user, api.getRegistrationStatus,
+                      REGISTRATION_REQUEST.combined_message_class(
+                          websafeConferenceKey=wsck, token=token))
+
+    counter = iter(xrange(10 ** 9))
+
+    def newSession():
+        form = sessionForm(rng, next(counter), data.speakers)
+        form.websafeConferenceKey = data.conferences[0]
+        return form
+
+    # sessions are added to the first conference, as its organizer
+    organizer = ndb.Key(urlsafe=data.conferences[0]).parent().string_id()
+
+    def syncWishlist():
+        # a session can't be both added and removed
+        keys = rng.sample(data.sessions, min(10, len(data.sessions)))
+        return asUser(data.user(), api.syncWishlist,
+                      WishlistSyncForm(add=keys[::2], remove=keys[1::2]))
+
+    return {
+        'getProfile': lambda: asUser(
+            data.user(), api.getProfile, message_types.VoidMessage()),
+        'saveProfile': lambda: asUser(
+            data.user(), api.saveProfile,
+            ProfileMiniForm(displayName='Name %d' % rng.randrange(1000),
+                            teeShirtSize=TeeShirtSize.M_W)),
+        'createConference': lambda: asUser(
+            data.user(), api.createConference, conferenceForm(rng, next(counter))),
+        'queryConferences': lambda: asUser(
+            data.user(), api.queryConferences, ConferenceQueryForms(filters=[
+                ConferenceQueryForm(field='CITY', operator='EQ', value=rng.choice(CITIES)),
+                ConferenceQueryForm(field='MAX_ATTENDEES', operator='GT', value='10')])),
+        # != runs as a merged multi-query, which needs a key order to page
+        'queryConferencesNotEqual': lambda: asUser(
+            data.user(), api.queryConferences, ConferenceQueryForms(filters=[
+                ConferenceQueryForm(field='CITY', operator='NE', value=rng.choice(CITIES))])),
+        'getConference': lambda: asUser(
+            data.user(), api.getConference, conference(websafeConferenceKey=data.conference())),
+        'getConferencesCreated': lambda: asUser(
+            data.user(), api.getConferencesCreated, message_types.VoidMessage()),
+        'registerForConference': register,
+        'unregisterFromConference': unregister,
+        'requestRegistration': requestRegistration,
+        'getRegistrationStatus': registrationStatus,
+        'getConferencesToAttend': lambda: asUser(
+            data.user(), api.getConferencesToAttend, message_types.VoidMessage()),
+        'createSession': lambda: asUser(organizer, api.createSession, newSession()),
+        'createSessions': lambda: asUser(
+            organizer, api.createSessions, SessionBatchForm(
+                websafeConferenceKey=data.conferences[0],
+                items=[sessionForm(rng, next(counter), data.speakers) for i in range(10)])),
+        'getConferenceSessions': lambda: asUser(
+            data.user(), api.getConferenceSessions,
+            QuerySessionByKey(websafeConferenceKey=data.conference())),
+        'getConferenceSessionsByType': lambda: asUser(
+            data.user(), api.getConferenceSessionsByType,
+            QuerySessionByType(websafeConferenceKey=data.conference(),
+                               typeOfSession=rng.choice(SESSION_TYPES))),
+        'getSessionsBySpeaker': lambda: asUser(
+            data.user(), api.getSessionsBySpeaker,
+            QuerySessionBySpeaker(speaker=data.speaker())),
+        'getSessionsByDuration': lambda: asUser(
+            data.user(), api.getSessionsByDuration,
+            QuerySessionByDuration(websafeConferenceKey=data.conference(),
+                                   duration=rng.choice(DURATIONS),
+                                   direction=rng.choice([True, False]))),
+        'getSessionsByStartTime': lambda: asUser(
+            data.user(), api.getSessionsByStartTime,
+            QuerySessionByStartTime(websafeConferenceKey=data.conference(),
+                                    startTime='%02d:00' % rng.randrange(8, 18),
+                                    direction=rng.choice([True, False]))),
+        'searchSessions': lambda: asUser(
+            data.user(), api.searchSessions, SessionQueryForms(filters=[
+                SessionQueryForm(field='TYPE', operator='NE', value='workshop'),
+                SessionQueryForm(field='START_TIME', operator='LT',
+                                 value='%02d:00' % rng.randrange(9, 18))])),
+        # DATE equality is pushed down to the datastore, and so is a DATE
+        # range when there is no equality
+        'searchSessionsByDate': lambda: asUser(
+            data.user(), api.searchSessions, SessionQueryForms(filters=[
+                SessionQueryForm(field='DATE', operator=rng.choice(['EQ', 'GTEQ']),
+                                 value=str(date(2027, 1, 1) + timedelta(days=rng.randrange(365)))),
+                SessionQueryForm(field='TYPE', operator='NE', value='workshop')])),
+        'addSessionToWishlist': lambda: asUser(
+            data.user(), api.addSessionToWishlist, SessionWebsafe(websafeKey=data.session())),
+        'removeSessionFromWishlist': lambda: asUser(
+            data.user(), api.removeSessionFromWishlist, SessionWebsafe(websafeKey=data.session())),
+        'syncWishlist': syncWishlist,
+        'getSessionsInWishlist': lambda: asUser(
+            data.user(), api.getSessionsInWishlist, message_types.VoidMessage()),
+        'getWishlistByConference': lambda: asUser(
+            data.user(), api.getWishlistByConference, message_types.VoidMessage()),
+        'getWishlistConflicts': lambda: asUser(
+            data.user(), api.getWishlistConflicts, message_types.VoidMessage()),
+        'getFeaturedSpeaker': lambda: asUser(
+            data.user(), api.getFeaturedSpeaker,
+            conference(websafeConferenceKey=rng.choice([None, data.conference()]))),
+    }
+
+
+#--------------------------------### Measurement ###--------------------------------------------------#
+
+def percentile(values, p):
+    """Return the p'th percentile of sorted values, by nearest rank."""
+    index = max(0, int(round(p / 100.0 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def run(tb, name, scenario, iterations, latency=None):
+    """Call one method iterations times, returning its results."""
+    timer = timeit.default_timer
+    rounds = 0
+    times = []
+    calls = {}
+    services = {}
+    errors = {}
+    for i in range(iterations):
+        call = scenario()
+        newRequest()
+        previous = rpcstats.last()
+        before = latency.rounds if latency else 0
+        start = timer()
+        try:
+            call()
+        except (endpoints.ServiceException, ValueError) as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+        times.append((timer() - start) * 1000)
+        if latency:
+            rounds += latency.rounds - before
+        summary = rpcstats.last()
+        if summary is None or summary is previous:
+            summary = {'calls': {}, 'services': {}}
+        for rpc, totals in summary['calls'].items():
+            calls[rpc] = calls.get(rpc, 0) + totals['count']
+        for service, totals in summary['services'].items():
+            counts = services.setdefault(service, {'calls': 0, 'entities': 0})
+            counts['calls'] += totals['calls']
+            counts['entities'] += totals['entities']
+        flushTasks(tb)
+
+    times.sort()
+    ms = {'mean': round(sum(times) / len(times), 3), 'max': round(times[-1], 3)}
+    for p in PERCENTILES:
+        ms['p%d' % p] = round(percentile(times, p), 3)
+    return {
+        'iterations': iterations,
+        'errors': errors,
+        'ms': ms,
+        # means per call
+        'rpcs': sum(calls.values()) / float(iterations),
+        'rounds': rounds / float(iterations),
+        'calls': dict((rpc, n / float(iterations)) for rpc, n in calls.items()),
+        'services': dict((service, dict((f, n / float(iterations)) for f, n in counts.items()))
+                         for service, counts in services.items()),
+    }
+
+
+def benchmark(args):
+    """Build the dataset and run every method, returning the results."""
+    rng = random.Random(args.seed)
+    tb = setUp()
+    api = ConferenceApi()
+    latency = None
+    try:
+        start = timeit.default_timer()
+        data = build(tb, api, args, rng)
+        setup = {'seconds': round(timeit.default_timer() - start, 3),
+                 'peakRssKb': peakRss()}
+
+        # the dataset is built without latency, which would only slow it down
+        if args.latency:
+            latency = Latency(args.latency, serial=args.serial)
+            latency.install()
+        table = scenarios(api, data, rng)
+        selected = args.only or sorted(table)
+        results = {}
+        for name in selected:
+            results[name] = run(tb, name, table[name], args.iterations, latency)
+            sys.stderr.write('.')
+        sys.stderr.write('\n')
+    finally:
+        if latency:
+            latency.uninstall()
+        tb.deactivate()
+
+    params = dict((k, getattr(args, k)) for k in
+                  ('conferences', 'sessions', 'profiles', 'registrations',
+                   'wishlist', 'iterations', 'seed'))
+    if args.latency:
+        params.update(latency=args.latency, serial=args.serial)
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'params': params,
+        'setup': setup,
+        'peakRssKb': peakRss(),
+        # API methods with no scenario here, which should be added
+        'uncovered': sorted(set(rpcstats.ENDPOINTS) - set(table)),
+        'endpoints': results,
+    }
+
+
+#--------------------------------### Reports ###--------------------------------------------------#
+
+def report(results):
+    """Print a table of results."""
+    print('%-28s %8s %8s %8s %8s %7s %7s %6s' % ('method', 'mean', 'p50', 'p90', 'p99',
+                                                 'rpcs', 'rounds', 'errors'))
+    for name, r in sorted(results['endpoints'].items()):
+        ms = r['ms']
+        print('%-28s %8.2f %8.2f %8.2f %8.2f %7.1f %7.1f %6d' % (
+            name, ms['mean'], ms['p50'], ms['p90'], ms['p99'], r['rpcs'],
+            r.get('rounds', 0), sum(r['errors'].values())))
+    print('setup %.1fs, peak RSS %d KB' % (results['setup']['seconds'], results['peakRssKb']))
+    if results['uncovered']:
+        print('not benchmarked: %s' % ', '.join(results['uncovered']))
+
+
+def compare(old, new, threshold):
+    """Print each method's change from old to new, returning the regressed methods."""
+    if old['params'] != new['params']:
+        print('warning: runs used different parameters')
+    regressed = []
+    print('%-28s %10s %10s %7s %8s' % ('method', 'old p50', 'new p50', 'ratio', 'rpcs'))
+    for name, r in sorted(new['endpoints'].items()):
+        before = old['endpoints'].get(name)
+        if not before:
+            print('%-28s %10s %10.2f' % (name, '-', r['ms']['p50']))
+            continue
+        ratio = r['ms']['p50'] / max(before['ms']['p50'], 0.001)
+        rpcs = r['rpcs'] - before['rpcs']
+        flag = ''
+        if ratio > threshold or rpcs > 0.01:
+            flag = '  REGRESSED'
+            regressed.append(name)
+        print('%-28s %10.2f %10.2f %6.2fx %+8.1f%s' % (
+            name, before['ms']['p50'], r['ms']['p50'], ratio, rpcs, flag))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--conferences', type=int, default=20)
+    parser.add_argument('--sessions', type=int, default=30,
+                        help='sessions per conference')
+    parser.add_argument('--profiles', type=int, default=50)
+    parser.add_argument('--registrations', type=int, default=3,
+                        help='conferences each profile registers for')
+    parser.add_argument('--wishlist', type=int, default=10,
+                        help='sessions on each profile\'s wishlist')
+    parser.add_argument('--iterations', type=int, default=50,
+                        help='calls of each method')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', nargs='*', help='methods to run (default all)')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds each RPC takes to be answered')
+    parser.add_argument('--serial', action='store_true',
+                        help='with --latency, wait for every RPC as soon as it is made')
+    parser.add_argument('--output', help='write results as JSON here')
+    parser.add_argument('--input', help='read results from here rather than running')
+    parser.add_argument('--compare', help='results file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='p50 ratio counted as a regression')
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input) as f:
+            results = json.load(f)
+    else:
+        results = benchmark(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    report(results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(old, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
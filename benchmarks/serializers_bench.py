@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""serializers_bench.py
+
+Micro-benchmark of the entity to form serializers in Project/serializers.py
+against the field-by-field loops they replaced.
+
+No datastore is needed; entities are built in memory. Run with the App
+Engine SDK's Python 2.7:
+
+    GAE_SDK=/path/to/google_appengine python benchmarks/serializers_bench.py [rows]
+
+"""
+
+import os
+import sys
+import timeit
+from datetime import date, time
+
+PROJECT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Project')
+sys.path.insert(0, os.path.normpath(PROJECT))
+sdk = os.environ.get('GAE_SDK')
+if sdk:
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+os.environ.setdefault('APPLICATION_ID', 'dev~bench')
+
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import ProfileForm
+from models import TeeShirtSize
+from models import Conference
+from models import ConferenceForm
+from models import Session
+from models import SessionForm
+import serializers
+
+
+#--------------------------------### Previous serializers ###--------------------------------------------------#
+
+def legacyProfile(prof):
+    pf = ProfileForm()
+    for field in pf.all_fields():
+        if hasattr(prof, field.name):
+            if field.name == 'teeShirtSize':
+                setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
+            else:
+                setattr(pf, field.name, getattr(prof, field.name))
+    pf.check_initialized()
+    return pf
+
+
+def legacyConference(conf):
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def legacySession(session):
+    result = SessionForm()
+    for field in result.all_fields():
+        if hasattr(session, field.name):
+            if field.name == 'startTime' or field.name == 'date':
+                setattr(result, field.name, str(getattr(session, field.name)))
+            else:
+                setattr(result, field.name, getattr(session, field.name))
+        if field.name == "websafeConferenceKey":
+            setattr(result, field.name, session.key.parent().urlsafe())
+        if field.name == "websafeKey":
+            setattr(result, field.name, session.key.urlsafe())
+    result.check_initialized()
+    return result
+
+
+#--------------------------------### Data ###--------------------------------------------------#
+
+def makeEntities(rows):
+    """Return (profiles, conferences, sessions), rows of each."""
+    profiles, conferences, sessions = [], [], []
+    for i in range(rows):
+        p_key = ndb.Key(Profile, 'user%d' % i)
+        profiles.append(Profile(key=p_key, displayName='User %d' % i,
+                                mainEmail='user%d@example.com' % i,
+                                teeShirtSize='M_W'))
+        c_key = ndb.Key(Conference, i + 1, parent=p_key)
+        conferences.append(Conference(
+            key=c_key, name='Conference %d' % i, description='About %d' % i,
+            organizerUserId='user%d' % i, topics=['Web', 'Cloud'],
+            city='City %d' % (i % 50), startDate=date(2026, 1 + i % 12, 1),
+            month=1 + i % 12, endDate=date(2026, 1 + i % 12, 3),
+            maxAttendees=100, seatsAvailable=100))
+        sessions.append(Session(
+            key=ndb.Key(Session, i + 1, parent=c_key), name='Session %d' % i,
+            typeOfSession=['lecture'], highlights=['Intro'],
+            speaker=['Speaker %d' % (i % 20)], duration=60,
+            date=date(2026, 1 + i % 12, 2), startTime=time(9 + i % 8, 0)))
+    return profiles, conferences, sessions
+
+
+def bench(label, func, repeat=5):
+    """Print and return the best time of func over repeat runs."""
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print('%-28s %8.2f ms' % (label, best * 1000))
+    return best
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    profiles, conferences, sessions = makeEntities(rows)
+    print('%s rows each, best of 5' % rows)
+
+    pairs = [
+        ('Profile', lambda: [legacyProfile(p) for p in profiles],
+                    lambda: [serializers.PROFILE.toForm(p) for p in profiles]),
+        ('Conference', lambda: [legacyConference(c) for c in conferences],
+                       lambda: [serializers.CONFERENCE.toForm(c, websafeKey=c.key.urlsafe())
+                                for c in conferences]),
+        ('Session', lambda: [legacySession(s) for s in sessions],
+                    lambda: serializers.sessionForms(sessions)),
+    ]
+    for name, legacy, compiled in pairs:
+        old = bench('%s (loop)' % name, legacy)
+        new = bench('%s (compiled)' % name, compiled)
+        print('%-28s %8.2fx' % ('%s speedup' % name, old / new))
+
+
+if __name__ == '__main__':
+    main()
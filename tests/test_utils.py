@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+"""test_utils.py
+
+Tests of the OAuth token cache in Project/utils.py, with testbed's
+memcache stub and a stand-in for urlfetch.fetch. Run with the App
+Engine SDK's Python 2.7:
+
+    GAE_SDK=/path/to/google_appengine python -m unittest discover tests
+
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+
+PROJECT = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'Project'))
+sys.path.insert(0, PROJECT)
+sdk = os.environ.get('GAE_SDK')
+if sdk:
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
+
+import cache
+import utils
+
+
+TOKEN = 'token-1'
+DIGEST = hashlib.sha256(TOKEN).hexdigest()
+
+
+class Response(object):
+    """Response -- What the stand-in fetch returns."""
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+class FakeFetch(object):
+    """FakeFetch -- Stand-in for urlfetch.fetch, answering with a fixed tokeninfo response.
+
+    If gate is given, each call waits for it to be set first.
+    """
+
+    def __init__(self, info=None, gate=None):
+        self.info = info
+        self.gate = gate
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, url):
+        with self.lock:
+            self.calls.append(url)
+        if self.gate:
+            self.gate.wait(5)
+        if self.info is None:
+            # answered without the retry loop sleeping
+            return Response(400, '{"error": "invalid_token"}')
+        return Response(200, json.dumps(self.info))
+
+
+class TokenCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        utils._tokens = cache.LRUCache(utils.TOKEN_CACHE_SIZE)
+        utils._lookups.clear()
+        os.environ['HTTP_AUTHORIZATION'] = 'Bearer %s' % TOKEN
+        os.environ.pop('OAUTH_USER_ID', None)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+        os.environ.pop('HTTP_AUTHORIZATION', None)
+
+    def userId(self, fetch):
+        return utils.getUserId(None, id_type='oauth', fetch=fetch)
+
+    def cached(self):
+        """Return the (user id, expires) memcache holds for TOKEN, or None."""
+        return memcache.get(utils.MEMCACHE_TOKEN_KEY % DIGEST)
+
+    def localExpires(self):
+        """Return when the local entry for TOKEN expires."""
+        return utils._tokens._items[DIGEST][1]
+
+    def testLocalHit(self):
+        fetch = FakeFetch({'user_id': '42', 'expires_in': 600})
+        self.assertEqual(self.userId(fetch), '42')
+        # served locally, without memcache or tokeninfo
+        memcache.flush_all()
+        self.assertEqual(self.userId(fetch), '42')
+        self.assertEqual(len(fetch.calls), 1)
+        self.assertEqual(self.cached(), None)
+
+    def testMemcacheHitKeepsRemainingTime(self):
+        expires = time.time() + 100
+        memcache.set(utils.MEMCACHE_TOKEN_KEY % DIGEST, ('42', expires), time=100)
+        fetch = FakeFetch({'user_id': '99'})
+        self.assertEqual(self.userId(fetch), '42')
+        self.assertEqual(fetch.calls, [])
+        # the local copy expires with the memcache one, not a fresh ttl
+        self.assertAlmostEqual(self.localExpires(), expires, delta=1)
+
+    def testExpiresIn(self):
+        self.userId(FakeFetch({'user_id': '42', 'expires_in': 120}))
+        user_id, expires = self.cached()
+        self.assertEqual(user_id, '42')
+        self.assertAlmostEqual(expires, time.time() + 120, delta=2)
+        self.assertAlmostEqual(self.localExpires(), time.time() + 120, delta=2)
+
+    def testExpiresInIsCapped(self):
+        self.userId(FakeFetch({'user_id': '42', 'expires_in': 10 ** 6}))
+        self.assertAlmostEqual(self.cached()[1], time.time() + utils.MAX_TOKEN_TIME, delta=2)
+
+    def testExpiresInDefault(self):
+        self.userId(FakeFetch({'user_id': '42', 'expires_in': 'soon'}))
+        self.assertAlmostEqual(self.cached()[1], time.time() + utils.DEFAULT_TOKEN_TIME, delta=2)
+        utils._tokens = cache.LRUCache(utils.TOKEN_CACHE_SIZE)
+        memcache.flush_all()
+        self.userId(FakeFetch({'user_id': '42'}))
+        self.assertAlmostEqual(self.cached()[1], time.time() + utils.DEFAULT_TOKEN_TIME, delta=2)
+
+    def testExpiredTokenIsNotCached(self):
+        fetch = FakeFetch({'user_id': '42', 'expires_in': 0})
+        self.assertEqual(self.userId(fetch), '42')
+        self.assertEqual(self.cached(), None)
+        self.assertEqual(len(utils._tokens), 0)
+
+    def testFailedLookupIsNotCached(self):
+        fetch = FakeFetch()
+        self.assertEqual(self.userId(fetch), '')
+        self.assertEqual(self.cached(), None)
+        self.assertEqual(len(utils._tokens), 0)
+        calls = len(fetch.calls)
+        # the next request asks tokeninfo again
+        self.assertEqual(self.userId(fetch), '')
+        self.assertEqual(len(fetch.calls), calls * 2)
+
+    def runConcurrently(self, fetch, count=2):
+        """Look TOKEN up on count threads at once, returning their user ids.
+
+        tokeninfo only answers once every thread is waiting on the same
+        lookup.
+        """
+        results = [None] * count
+        joined = []
+        original = utils._Lookup
+
+        class CountedLookup(original):
+            # each request builds one as it takes its place in _lookups
+            def __init__(self):
+                original.__init__(self)
+                joined.append(self)
+
+        def lookUp(i):
+            results[i] = self.userId(fetch)
+
+        utils._Lookup = CountedLookup
+        try:
+            threads = [threading.Thread(target=lookUp, args=(i,)) for i in range(count)]
+            for thread in threads:
+                thread.start()
+            # wait for the first lookup to be at tokeninfo, and every
+            # request to have reached _lookups
+            deadline = time.time() + 5
+            while (not fetch.calls or len(joined) < count) and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(len(joined), count)
+            # requests take their place in _lookups holding _lookups_lock,
+            # so once it is free every one of them has the shared lookup
+            with utils._lookups_lock:
+                self.assertTrue(DIGEST in utils._lookups)
+            fetch.gate.set()
+            for thread in threads:
+                thread.join(5)
+        finally:
+            utils._Lookup = original
+        return results
+
+    def testConcurrentRequestsShareOneFetch(self):
+        fetch = FakeFetch({'user_id': '42', 'expires_in': 600}, gate=threading.Event())
+        self.assertEqual(self.runConcurrently(fetch), ['42', '42'])
+        self.assertEqual(len(fetch.calls), 1)
+        self.assertEqual(utils._lookups, {})
+
+    def testConcurrentRequestsShareAFailedLookup(self):
+        fetch = FakeFetch(gate=threading.Event())
+        self.assertEqual(self.runConcurrently(fetch, count=3), ['', '', ''])
+        # one lookup's retries, not one per request
+        self.assertEqual(len(fetch.calls), 3)
+        self.assertEqual(utils._lookups, {})
+
+
+if __name__ == '__main__':
+    unittest.main()